@@ -3,145 +3,309 @@ API Microservice
 Handles HTTP requests for QR code generation and advertisement management.
 """
 
+import atexit
+import binascii
+import fcntl
+import hashlib
 import json
 import os
-import re
-import uuid
+import shutil
+import threading
+import time
 from functools import wraps
-from io import BytesIO
+from typing import Optional
 
-from flask import Flask, jsonify, request, send_file, send_from_directory, url_for
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from cachetools import TTLCache
+from flask_orjson import OrjsonProvider
+import orjson
+import redis
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.security import safe_join
 
 from qr_service import QRCodeService
-from services.ads_service import AdsService
 from services.admin_service import AdminService
+from services.ads_service import AdsService
 from services.auth_service import find_user_by_id
 from services.qr_history_service import log_qr_generation
+from services.log_writer import flush_log_writers
 from database import db
+from config import config
 import asyncio
+from utils.ads_store import read_ads_files, replay_ads
+from utils.admin_auth import check_admin_credentials
 from utils.jwt_utils import create_access_token, decode_access_token
+from utils.validation import (
+    ALLOWED_IMAGE_EXTENSIONS,
+    URL_SCHEMES,
+    VALID_PLACEMENTS,
+    IMAGE_SIGNATURE_SIZE,
+    allowed_file,
+    is_image_data,
+    upload_filename,
+    validate_url,
+    validate_urls,
+)
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for cross-origin requests
+try:
+    import uvloop
+    _new_event_loop = uvloop.new_event_loop
+except ImportError:
+    _new_event_loop = asyncio.new_event_loop
+
+# One long-lived event loop for all Motor calls. run_sync() per request
+# built and tore down a loop each time and could not reuse the Mongo pool.
+_loop = _new_event_loop()
+threading.Thread(target=_loop.run_forever, name="motor-loop", daemon=True).start()
+
+
+def run_sync(coro):
+    """Run a coroutine on the shared background loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+def run_background(coro):
+    """Schedule a coroutine on the shared loop without waiting; failures are only logged."""
+    future = asyncio.run_coroutine_threadsafe(coro, _loop)
+    future.add_done_callback(_log_background_error)
+
+
+def _log_background_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Background task failed: {future.exception()}")
 
-@app.after_request
-def add_standard_fields(response):
+
+run_sync(db.connect_db())
+run_sync(db.ensure_indexes())
+# Queued history/login writes are batched on the background loop; write out the rest on exit
+atexit.register(lambda: run_sync(flush_log_writers()))
+
+app = Flask(__name__)
+app.json = OrjsonProvider(app)  # orjson-backed jsonify / get_json
+# CORS only on the routes browsers call, so other responses skip the Origin handling
+CORS(app, resources={
+    r"/ads*": {"origins": config.ALLOWED_ORIGINS},
+    r"/admin/*": {"origins": config.ALLOWED_ORIGINS},
+    r"/generate*": {"origins": config.ALLOWED_ORIGINS},
+})
+
+def envelope(data, status_code=200) -> dict:
     """
-    Standardize all JSON responses to include message, status, and status_code.
+    Wrap data in the standard message/status/status_code envelope.
     """
-    if response.is_json:
-        try:
-            data = response.get_json()
-            
-            # Prepare standard fields
-            status = "success" if response.status_code < 400 else "error"
-            status_code = response.status_code
+    status = "success" if status_code < 400 else "error"
+    if isinstance(data, dict):
+        if "message" in data:
+            message = data["message"]
+        # If there's an 'error' field but no 'message', use it
+        elif "error" in data:
+            message = data["error"]
+        else:
             message = "successful"
-            
-            if isinstance(data, dict):
-                # Preserving existing message if present
-                if "message" in data:
-                    message = data.pop("message")
-                # If there's an 'error' field but no 'message', use it
-                elif "error" in data:
-                    message = data["error"]
-                
-                standard_response = {
-                    "status": status,
-                    "status_code": status_code,
-                    "message": message,
-                    **data
-                }
-            else:
-                # For lists or other types
-                standard_response = {
-                    "status": status,
-                    "status_code": status_code,
-                    "message": message,
-                    "data": data
-                }
-            
-            response.set_data(json.dumps(standard_response))
-        except Exception:
-            pass # Fallback to original
-            
-    return response
+        body = {"status": status, "status_code": status_code, "message": message, **data}
+    else:
+        # For lists or other types
+        body = {"status": status, "status_code": status_code, "message": "successful", "data": data}
+    return body
+
+
+def respond(data, status_code=200):
+    """
+    Return data as a JSON response in the standard envelope.
+    """
+    return jsonify(envelope(data, status_code)), status_code
+
+
+@app.errorhandler(Exception)
+def handle_unexpected_error(error):
+    """Return unhandled errors as JSON; HTTP errors (404, 405, 413, ...) pass through."""
+    if isinstance(error, HTTPException):
+        return error
+    # Details go to the log only; exception text can expose Mongo/filesystem internals
+    app.logger.exception("Unhandled error on %s %s", request.method, request.path)
+    return respond({
+        "error": "Internal server error",
+        "message": "An unexpected error occurred"
+    }, 500)
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_upload_too_large(error):
+    """Report bodies over MAX_CONTENT_LENGTH as JSON instead of Werkzeug's HTML page."""
+    return respond({
+        "error": "Payload too large",
+        "message": f"Uploads are limited to {MAX_UPLOAD_SIZE // (1024 * 1024)} MB"
+    }, 413)
+
 
 # Paths and configuration
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
 ADS_DATA_FILE = os.path.join(BASE_DIR, "ads_data.json")
+ADS_LOG_FILE = os.path.join(BASE_DIR, "ads_data.log.jsonl")
+ADS_LOG_MIN_COMPACT_SIZE = 64 * 1024
+ADS_FLUSH_INTERVAL = 1.0
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
-VALID_PLACEMENTS = {
-    "top-wide",
-    "vertical-right",
-    "left-1",
-    "left-2",
-    "bottom-wide-1",
-    "bottom-wide-2",
-    "mobile-bottom-1",
-    "mobile-bottom-2",
-}
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+UPLOAD_COPY_BUFFER_SIZE = 1024 * 1024
+# Browser/CDN lifetime of uploaded images; names are random tokens (upload_filename) and never reused
+UPLOAD_MAX_AGE = 86400
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_SIZE  # Reject oversized bodies before buffering
 
-ADMIN_USERNAME = "admin@123"
-ADMIN_PASSWORD = "1234"
 
 # Initialize QR Code Service
 qr_service = QRCodeService()
 
+# Shared QR image cache (only when REDIS_URL is configured)
+# A slow Redis times out into plain generation instead of stalling /generate*
+redis_client = redis.Redis.from_url(
+    config.REDIS_URL,
+    socket_timeout=config.REDIS_TIMEOUT,
+    socket_connect_timeout=config.REDIS_TIMEOUT,
+) if config.REDIS_URL else None
+
+
+def qr_cache_key(**options) -> bytes:
+    """Build the Redis key for a QR image from all of its generation options."""
+    encoded = json.dumps(options, sort_keys=True, default=str).encode("utf-8")
+    return b"qr:png:" + hashlib.sha1(encoded).digest()
+
 
-def validate_url(url: str) -> bool:
+def generate_qr_png(**options):
     """
-    Validate URL format.
+    Generate QR code PNG bytes, reusing a cached image for repeated requests.
+
+    Falls back to plain generation when Redis is not configured or unreachable.
     """
-    if not url or not isinstance(url, str):
-        return False
-
-    url_pattern = re.compile(
-        r"^https?://"
-        r"(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|"
-        r"localhost|"
-        r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})"
-        r"(?::\d+)?"
-        r"(?:/?|[/?]\S+)$",
-        re.IGNORECASE,
-    )
-    return url_pattern.match(url) is not None
+    if redis_client is None:
+        return qr_service.generate_qr_code(**options)
+
+    key = qr_cache_key(**options)
+    try:
+        cached = redis_client.get(key)
+        if cached:
+            return cached
+    except redis.RedisError:
+        return qr_service.generate_qr_code(**options)
+
+    qr_code_bytes = qr_service.generate_qr_code(**options)
+    if qr_code_bytes:
+        try:
+            redis_client.setex(key, config.QR_CACHE_TTL, qr_code_bytes)
+        except redis.RedisError:
+            pass
+    return qr_code_bytes
 
 
-def allowed_file(filename: str) -> bool:
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
+def read_json_body() -> dict:
+    """
+    Parse the request body as a JSON object with orjson.
+
+    Skips Flask's content-type/charset handling and does not cache the raw body;
+    returns an empty dict for a missing, malformed, or non-object body.
+    """
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
 
 
 def load_ads_data():
-    """Load ads from disk."""
-    if not os.path.exists(ADS_DATA_FILE):
-        return []
-    try:
-        with open(ADS_DATA_FILE, "r", encoding="utf-8") as fh:
-            return json.load(fh)
-    except Exception:
-        return []
+    """Load ads from the snapshot on disk and replay the mutation log over it."""
+    return replay_ads(*read_ads_files(ADS_DATA_FILE, ADS_LOG_FILE))
 
 
 def save_ads_data(ads):
-    """Persist ads to disk."""
-    with open(ADS_DATA_FILE, "w", encoding="utf-8") as fh:
-        json.dump(ads, fh, indent=2)
+    """Write a full snapshot of ads to disk and reset the mutation log."""
+    tmp_path = ADS_DATA_FILE + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(orjson.dumps(ads, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, ADS_DATA_FILE)
+    open(ADS_LOG_FILE, "wb").close()
+
+
+# Mutations waiting for the background writer, already serialized
+_pending_ads_log = []
+_pending_ads_log_lock = threading.Lock()
+_ads_file_lock = threading.Lock()
+_ads_log_dirty = threading.Event()
+
+
+def append_ads_log(record):
+    """Queue one ad mutation; the writer thread persists it within ADS_FLUSH_INTERVAL."""
+    line = orjson.dumps(record) + b"\n"
+    with _pending_ads_log_lock:
+        _pending_ads_log.append(line)
+    _ads_log_dirty.set()
+
+
+def flush_ads_log():
+    """Append all queued mutations in one write, compacting the log once it outgrows the snapshot."""
+    with _ads_file_lock:
+        with _pending_ads_log_lock:
+            lines = _pending_ads_log[:]
+            _pending_ads_log.clear()
+        if not lines:
+            return
+
+        with open(ADS_LOG_FILE, "ab") as fh:
+            # Every gunicorn worker appends to the same log; hold it exclusively
+            # across the append and any compaction
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            fh.write(b"".join(lines))
+            fh.flush()
+            os.fsync(fh.fileno())
+
+            snapshot_size = os.path.getsize(ADS_DATA_FILE) if os.path.exists(ADS_DATA_FILE) else 0
+            if os.path.getsize(ADS_LOG_FILE) > 2 * max(snapshot_size, ADS_LOG_MIN_COMPACT_SIZE):
+                # Rebuild from disk, not this worker's ads_by_id, so the snapshot
+                # keeps what other workers have appended
+                save_ads_data(list(load_ads_data().values()))
+
+
+def _ads_log_writer():
+    while True:
+        _ads_log_dirty.wait()
+        time.sleep(ADS_FLUSH_INTERVAL)  # Let a burst of edits collapse into one write
+        _ads_log_dirty.clear()
+        try:
+            flush_ads_log()
+        except Exception as e:
+            print(f"Failed to persist ads: {e}")
+
 
+# In-memory ads keyed by id (insertion-ordered, so it also preserves file order)
+ads_by_id = load_ads_data()
+_next_ad_id = max(ads_by_id, default=0) + 1
+threading.Thread(target=_ads_log_writer, name="ads-writer", daemon=True).start()
+atexit.register(flush_ads_log)
 
-ads_data = load_ads_data()
+
+def check_ad_redirects(ads) -> list:
+    """Return the ids of ads whose redirectUrl is set but not a valid URL."""
+    redirect_ads = [ad for ad in ads if ad.get("redirectUrl")]
+    valid = validate_urls([ad["redirectUrl"] for ad in redirect_ads])
+    return [ad["id"] for index, ad in enumerate(redirect_ads) if index not in valid]
+
+
+invalid_redirect_ids = check_ad_redirects(ads_by_id.values())
+if invalid_redirect_ids:
+    print(f"Warning: ads with invalid redirectUrl: {invalid_redirect_ids}")
+
+
+_next_ad_id_lock = threading.Lock()
 
 
 def next_ad_id():
     """Generate the next ad id."""
-    if not ads_data:
-        return 1
-    return max(ad["id"] for ad in ads_data) + 1
+    global _next_ad_id
+    with _next_ad_id_lock:
+        ad_id = _next_ad_id
+        _next_ad_id += 1
+    return ad_id
 
 
 def require_auth(fn):
@@ -151,12 +315,12 @@ def require_auth(fn):
     def wrapper(*args, **kwargs):
         auth_header = request.headers.get("Authorization", "")
         if not auth_header.startswith("Bearer "):
-            return jsonify({"error": "Unauthorized", "message": "Missing Bearer token"}), 401
+            return respond({"error": "Unauthorized", "message": "Missing Bearer token"}, 401)
         token = auth_header.split(" ", 1)[1]
         
         payload = decode_access_token(token)
         if not payload or payload.get("role") != "admin":
-            return jsonify({"error": "Unauthorized", "message": "Invalid or expired admin token"}), 401
+            return respond({"error": "Unauthorized", "message": "Invalid or expired admin token"}, 401)
             
         return fn(*args, **kwargs)
 
@@ -177,16 +341,16 @@ def require_user(fn):
             token = request.args.get("authorization")
 
         if not token:
-            return jsonify({"error": "Unauthorized", "message": "Authentication required (Token or query param)"}), 401
+            return respond({"error": "Unauthorized", "message": "Authentication required (Token or query param)"}, 401)
         
         payload = decode_access_token(token)
         if not payload or "sub" not in payload:
-            return jsonify({"error": "Unauthorized", "message": "Invalid or expired user token"}), 401
+            return respond({"error": "Unauthorized", "message": "Invalid or expired user token"}, 401)
             
         user_id = payload["sub"]
-        user = asyncio.run(find_user_by_id(user_id))
+        user = run_sync(find_user_by_id(user_id))
         if not user:
-            return jsonify({"error": "Unauthorized", "message": "User not found"}), 401
+            return respond({"error": "Unauthorized", "message": "User not found"}, 401)
             
         # Add user to request for use in route
         request.user = user
@@ -195,14 +359,63 @@ def require_user(fn):
     return wrapper
 
 
+# Error payloads shared by the QR routes, built once at import
+ERR_NO_DATA = {
+    "error": "No data provided",
+    "message": "Please provide a JSON object with 'url' field"
+}
+ERR_URL_REQUIRED = {
+    "error": "URL is required",
+    "message": "Please provide a 'url' field in the request body"
+}
+ERR_INVALID_URL = {
+    "error": "Invalid URL format",
+    "message": "Please provide a valid URL (e.g., https://www.example.com)"
+}
+
+
+def require_valid_url(fn):
+    """
+    Decorator to validate the URL a QR route should encode.
+
+    The URL comes from the ``url`` path parameter when the route has one
+    (https:// is assumed if no scheme is given), otherwise from the JSON body.
+    The validated URL is stored on ``g.url`` and the parsed body on ``g.qr_request``.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if "url" in kwargs:
+            url = kwargs.pop("url")
+            if not url.startswith(URL_SCHEMES):
+                url = "https://" + url
+            data = {}
+        else:
+            data = read_json_body()
+            if not data:
+                return respond(ERR_NO_DATA, 400)
+            url = data.get("url")
+            if not url:
+                return respond(ERR_URL_REQUIRED, 400)
+
+        if not validate_url(url):
+            return respond(ERR_INVALID_URL, 400)
+
+        g.url = url
+        g.qr_request = data
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
 def load_settings():
     """Load global settings."""
     settings_file = os.path.join(BASE_DIR, "settings.json")
     if not os.path.exists(settings_file):
         return {"ads_enabled": True}
     try:
-        with open(settings_file, "r", encoding="utf-8") as fh:
-            return json.load(fh)
+        with open(settings_file, "rb") as fh:
+            return orjson.loads(fh.read())
     except Exception:
         return {"ads_enabled": True}
 
@@ -210,8 +423,8 @@ def load_settings():
 def save_settings(settings):
     """Save global settings."""
     settings_file = os.path.join(BASE_DIR, "settings.json")
-    with open(settings_file, "w", encoding="utf-8") as fh:
-        json.dump(settings, fh, indent=2)
+    with open(settings_file, "wb") as fh:
+        fh.write(orjson.dumps(settings, option=orjson.OPT_INDENT_2))
 
 
 def is_ads_enabled():
@@ -230,34 +443,84 @@ def serialize_ad(ad: dict) -> dict:
     }
 
 
+def has_image_content(image) -> bool:
+    """Sniff the upload's magic bytes instead of trusting its file extension."""
+    head = image.stream.read(IMAGE_SIGNATURE_SIZE)
+    image.stream.seek(0)
+    return is_image_data(head)
+
+
+def save_upload(image, image_path: str) -> None:
+    """
+    Copy an uploaded file to disk in large unbuffered chunks.
+
+    Writes to a .part file first and renames it into place; the .part file is
+    removed if the copy fails, so a failed upload never leaves a truncated image behind.
+    """
+    tmp_path = image_path + ".part"
+    try:
+        with open(tmp_path, "wb", buffering=0) as dst:
+            shutil.copyfileobj(image.stream, dst, length=UPLOAD_COPY_BUFFER_SIZE)
+    except BaseException:
+        remove_upload(tmp_path)
+        raise
+    os.replace(tmp_path, image_path)
+
+
+def remove_upload(image_path: Optional[str]) -> None:
+    """Delete an ad image; a file that is already gone is not an error."""
+    if not image_path:
+        return
+    try:
+        os.remove(image_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove {image_path}: {e}")
+
+
+def public_upload_url(filename: str) -> str:
+    """Build the public URL of an uploaded file without a url_for endpoint lookup."""
+    if config.PUBLIC_UPLOADS_BASE:
+        return f"{config.PUBLIC_UPLOADS_BASE}/{filename}"
+    if config.PUBLIC_BASE_URL:
+        return f"{config.PUBLIC_BASE_URL}/uploads/{filename}"
+    return f"{request.host_url}uploads/{filename}"
+
+
 @app.route("/uploads/<path:filename>", methods=["GET"])
 def serve_uploaded_file(filename):
-    """Serve uploaded ad images publicly."""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """
+    Serve uploaded ad images publicly.
+
+    Behind nginx (UPLOADS_ACCEL_PREFIX set) the file is handed off with
+    X-Accel-Redirect so nginx sendfile()s it; otherwise Flask serves it directly.
+    """
+    if not config.UPLOADS_ACCEL_PREFIX:
+        return send_from_directory(UPLOAD_FOLDER, filename, max_age=UPLOAD_MAX_AGE)
+
+    if safe_join(UPLOAD_FOLDER, filename) is None:
+        return respond({"error": "Not found", "message": "File does not exist"}, 404)
+    response = Response()
+    response.headers["X-Accel-Redirect"] = f"{config.UPLOADS_ACCEL_PREFIX.rstrip('/')}/{filename}"
+    # nginx passes this through the internal redirect; same caching as send_from_directory
+    response.cache_control.public = True
+    response.cache_control.max_age = UPLOAD_MAX_AGE
+    return response
 
 
 # ---------------------- Admin Authentication ---------------------- #
 @app.route("/admin/login", methods=["POST"])
 def admin_login():
     """Simple admin login returning a bearer token."""
-    payload = request.get_json(silent=True) or {}
+    payload = read_json_body()
     username = payload.get("username")
     password = payload.get("password")
 
-    if username != ADMIN_USERNAME or password != ADMIN_PASSWORD:
-        return jsonify({"error": "Unauthorized", "message": "Invalid credentials"}), 401
+    if not check_admin_credentials(username, password):
+        return respond({"error": "Unauthorized", "message": "Invalid credentials"}, 401)
 
-    from services.auth_service import find_user_by_email, create_user
-    admin_user = asyncio.run(find_user_by_email(username))
-    
-    if not admin_user:
-        admin_user = asyncio.run(create_user(
-            name="Admin",
-            email=username,
-            role="admin"
-        ))
-    
-    mongo_id = admin_user.get("mongo_id")
+    mongo_id = run_sync(AdminService.get_admin_mongo_id(username))
 
     token = create_access_token(data={
         "sub": username,
@@ -265,32 +528,32 @@ def admin_login():
         "name": "Admin",
         "role": "admin"
     })
-    return jsonify({"token": token, "tokenType": "Bearer"}), 200
+    return respond({"token": token, "tokenType": "Bearer"}, 200)
 
 
 @app.route("/admin/ads/status", methods=["GET"])
 def get_global_ads_status():
     """Get the current global status of advertisements."""
-    return jsonify({"ads_enabled": is_ads_enabled()}), 200
+    return respond({"ads_enabled": is_ads_enabled()}, 200)
 
 
 @app.route("/admin/ads/toggle", methods=["POST"])
 @require_auth
 def toggle_global_ads():
     """Enable or disable advertisements globally."""
-    data = request.get_json(silent=True) or {}
+    data = read_json_body()
     enabled = data.get("enabled")
     if enabled is None:
-        return jsonify({"error": "Bad Request", "message": "Missing 'enabled' boolean"}), 400
+        return respond({"error": "Bad Request", "message": "Missing 'enabled' boolean"}, 400)
     
     settings = load_settings()
     settings["ads_enabled"] = bool(enabled)
     save_settings(settings)
     
-    return jsonify({
+    return respond({
         "message": f"Ads {'enabled' if settings['ads_enabled'] else 'disabled'} successfully",
         "ads_enabled": settings["ads_enabled"]
-    }), 200
+    }, 200)
 
 
 
@@ -305,18 +568,17 @@ def create_ad():
 
     image = request.files.get("image")
     if not placement or placement not in VALID_PLACEMENTS:
-        return jsonify({"error": "Invalid placement", "message": "Placement must match allowed list"}), 400
+        return respond({"error": "Invalid placement", "message": "Placement must match allowed list"}, 400)
     if redirect_url and not validate_url(redirect_url):
-        return jsonify({"error": "Invalid redirectUrl", "message": "Provide a valid http/https URL"}), 400
+        return respond({"error": "Invalid redirectUrl", "message": "Provide a valid http/https URL"}, 400)
     if not image or image.filename == "":
-        return jsonify({"error": "Image required", "message": "Upload an image file under 'image' field"}), 400
-    if not allowed_file(image.filename):
-        return jsonify({"error": "Invalid image type", "message": f"Allowed: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}"}), 400
-
-    filename = f"{uuid.uuid4().hex}_{secure_filename(image.filename)}"
+        return respond({"error": "Image required", "message": "Upload an image file under 'image' field"}, 400)
+    if not allowed_file(image.filename) or not has_image_content(image):
+        return respond({"error": "Invalid image type", "message": f"Allowed: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}"}, 400)
+    filename = upload_filename(image.filename)
     image_path = os.path.join(UPLOAD_FOLDER, filename)
-    image.save(image_path)
-    image_url = url_for("serve_uploaded_file", filename=filename, _external=True)
+    save_upload(image, image_path)
+    image_url = public_upload_url(filename)
 
     ad = {
         "id": next_ad_id(),
@@ -326,30 +588,45 @@ def create_ad():
         "isActive": is_active,
         "imagePath": image_path,
     }
-    ads_data.append(ad)
-    save_ads_data(ads_data)
+    ads_by_id[ad["id"]] = ad
+    append_ads_log({"op": "put", "ad": ad})
 
-    return jsonify(serialize_ad(ad)), 201
+    return respond(serialize_ad(ad), 201)
+
+
+# Serialized GET /ads bodies per placement. The listing is read from Mongo, which
+# the FastAPI service writes, so entries expire instead of being invalidated.
+ADS_LIST_CACHE_TTL = 5
+_ads_list_cache = TTLCache(maxsize=64, ttl=ADS_LIST_CACHE_TTL)
+_ads_list_cache_lock = threading.Lock()
 
 
 @app.route("/ads", methods=["GET"])
 def list_ads():
     """List advertisements, optionally filtered by placement."""
-    if not asyncio.run(AdminService.is_ads_enabled()):
-        return jsonify([]), 200
-
     placement = request.args.get("placement")
-    ads = asyncio.run(AdsService.get_all_ads(placement=placement, only_active=True))
-    return jsonify([serialize_ad(ad) for ad in ads]), 200
+    with _ads_list_cache_lock:
+        body = _ads_list_cache.get(placement)
+
+    if body is None:
+        if not run_sync(AdminService.is_ads_enabled()):
+            ads = []
+        else:
+            ads = [serialize_ad(ad) for ad in run_sync(AdsService.get_all_ads(placement=placement, only_active=True))]
+        body = orjson.dumps(envelope(ads, 200))
+        with _ads_list_cache_lock:
+            _ads_list_cache[placement] = body
+
+    return Response(body, mimetype="application/json")
 
 
 @app.route("/ads/<int:ad_id>", methods=["PUT"])
 @require_auth
 def update_ad(ad_id: int):
     """Update an advertisement (metadata and/or image)."""
-    ad = next((item for item in ads_data if item["id"] == ad_id), None)
+    ad = ads_by_id.get(ad_id)
     if not ad:
-        return jsonify({"error": "Not found", "message": "Ad does not exist"}), 404
+        return respond({"error": "Not found", "message": "Ad does not exist"}, 404)
 
     # Support JSON or multipart form for flexibility
     if request.files or request.form:
@@ -358,15 +635,15 @@ def update_ad(ad_id: int):
         placement = data.get("placement", ad["placement"])
         is_active_raw = data.get("isActive")
     else:
-        data = request.get_json(silent=True) or {}
+        data = read_json_body()
         redirect_url = data.get("redirectUrl", ad["redirectUrl"])
         placement = data.get("placement", ad["placement"])
         is_active_raw = data.get("isActive")
 
     if placement not in VALID_PLACEMENTS:
-        return jsonify({"error": "Invalid placement", "message": "Placement must match allowed list"}), 400
+        return respond({"error": "Invalid placement", "message": "Placement must match allowed list"}, 400)
     if redirect_url and not validate_url(redirect_url):
-        return jsonify({"error": "Invalid redirectUrl", "message": "Provide a valid http/https URL"}), 400
+        return respond({"error": "Invalid redirectUrl", "message": "Provide a valid http/https URL"}, 400)
 
     if is_active_raw is not None:
         ad["isActive"] = bool(is_active_raw) if isinstance(is_active_raw, bool) else str(is_active_raw).lower() not in {"false", "0", "no"}
@@ -375,98 +652,87 @@ def update_ad(ad_id: int):
 
     image = request.files.get("image") if request.files else None
     if image and image.filename:
-        if not allowed_file(image.filename):
-            return jsonify({"error": "Invalid image type", "message": f"Allowed: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}"}), 400
-        filename = f"{uuid.uuid4().hex}_{secure_filename(image.filename)}"
+        if not allowed_file(image.filename) or not has_image_content(image):
+            return respond({"error": "Invalid image type", "message": f"Allowed: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}"}, 400)
+        filename = upload_filename(image.filename)
         image_path = os.path.join(UPLOAD_FOLDER, filename)
-        image.save(image_path)
-        old_path = ad.get("imagePath")
-        if old_path and os.path.exists(old_path):
-            try:
-                os.remove(old_path)
-            except OSError:
-                pass
+        save_upload(image, image_path)
+        remove_upload(ad.get("imagePath"))
         ad["imagePath"] = image_path
-        ad["imageUrl"] = url_for("serve_uploaded_file", filename=filename, _external=True)
+        ad["imageUrl"] = public_upload_url(filename)
 
-    save_ads_data(ads_data)
-    return jsonify(serialize_ad(ad)), 200
+    append_ads_log({"op": "put", "ad": ad})
+    return respond(serialize_ad(ad), 200)
 
 
 @app.route("/ads/<int:ad_id>", methods=["DELETE"])
 @require_auth
 def delete_ad(ad_id: int):
     """Delete an advertisement."""
-    global ads_data
-    ad = next((item for item in ads_data if item["id"] == ad_id), None)
+    ad = ads_by_id.pop(ad_id, None)
     if not ad:
-        return jsonify({"error": "Not found", "message": "Ad does not exist"}), 404
+        return respond({"error": "Not found", "message": "Ad does not exist"}, 404)
 
-    ads_data = [item for item in ads_data if item["id"] != ad_id]
-    image_path = ad.get("imagePath")
-    if image_path and os.path.exists(image_path):
-        try:
-            os.remove(image_path)
-        except OSError:
-            pass
-    save_ads_data(ads_data)
-    return jsonify({"deleted": ad_id}), 200
+    remove_upload(ad.get("imagePath"))
+    append_ads_log({"op": "del", "id": ad_id})
+    return respond({"deleted": ad_id}, 200)
 
 
 @app.route("/ads/<int:ad_id>/status", methods=["POST"])
 @require_auth
 def set_ad_status(ad_id: int):
     """Explicitly enable or disable a specific advertisement."""
-    ad = next((item for item in ads_data if item["id"] == ad_id), None)
+    ad = ads_by_id.get(ad_id)
     if not ad:
-        return jsonify({"error": "Not found", "message": "Ad does not exist"}), 404
+        return respond({"error": "Not found", "message": "Ad does not exist"}, 404)
     
-    data = request.get_json(silent=True) or {}
+    data = read_json_body()
     is_active = data.get("isActive")
     if is_active is None:
-        return jsonify({"error": "Bad Request", "message": "Missing 'isActive' boolean"}), 400
+        return respond({"error": "Bad Request", "message": "Missing 'isActive' boolean"}, 400)
     
     ad["isActive"] = bool(is_active)
-    save_ads_data(ads_data)
+    append_ads_log({"op": "put", "ad": ad})
     
     status_str = "enabled" if ad["isActive"] else "disabled"
-    return jsonify({
+    return respond({
         "message": f"Ad {ad_id} {status_str} successfully",
         "ad_id": ad_id,
         "isActive": ad["isActive"]
-    }), 200
+    }, 200)
 
 
 @app.route("/ads/<int:ad_id>/toggle", methods=["POST"])
 @require_auth
 def toggle_ad_status(ad_id: int):
     """Toggle the active status of a specific advertisement."""
-    ad = next((item for item in ads_data if item["id"] == ad_id), None)
+    ad = ads_by_id.get(ad_id)
     if not ad:
-        return jsonify({"error": "Not found", "message": "Ad does not exist"}), 404
+        return respond({"error": "Not found", "message": "Ad does not exist"}, 404)
     
     ad["isActive"] = not ad.get("isActive", True)
-    save_ads_data(ads_data)
+    append_ads_log({"op": "put", "ad": ad})
     
     status_str = "enabled" if ad["isActive"] else "disabled"
-    return jsonify({
+    return respond({
         "message": f"Ad {ad_id} {status_str} successfully",
         "ad_id": ad_id,
         "isActive": ad["isActive"]
-    }), 200
+    }, 200)
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return respond({
         "status": "healthy",
         "service": "QR Code API Service"
-    }), 200
+    }, 200)
 
 
 @app.route('/generate', methods=['POST'])
 @require_user
+@require_valid_url
 def generate_qr_code():
     """
     Generate QR code from URL with customization options
@@ -487,77 +753,50 @@ def generate_qr_code():
     Returns:
         JSON response with base64 encoded QR code image or error message
     """
-    try:
-        # Get JSON data from request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                "error": "No data provided",
-                "message": "Please provide a JSON object with 'url' field"
-            }), 400
-        
-        url = data.get('url')
-        
-        if not url:
-            return jsonify({
-                "error": "URL is required",
-                "message": "Please provide a 'url' field in the request body"
-            }), 400
-        
-        # Validate URL format
-        if not validate_url(url):
-            return jsonify({
-                "error": "Invalid URL format",
-                "message": "Please provide a valid URL (e.g., https://www.example.com)"
-            }), 400
-        
-        # Extract customization options (optional)
-        customization = data.get('customization', {})
-        fill_color = customization.get('fill_color', 'black')
-        back_color = customization.get('back_color', 'white')
-        pattern = customization.get('pattern', 'square')
-        error_correction = customization.get('error_correction', 'L')
-        logo = customization.get('logo')
-        logo_size = customization.get('logo_size', 0.3)
-        
-        # Generate QR code with customization
-        qr_code_base64 = qr_service.generate_qr_code_base64(
-            url=url,
-            fill_color=fill_color,
-            back_color=back_color,
-            pattern=pattern,
-            error_correction=error_correction,
-            logo=logo,
-            logo_size=logo_size
-        )
-        
-        if qr_code_base64:
-            # Log QR generation with customization info
-            asyncio.run(log_qr_generation(url, request.user["id"], customization))
-            return jsonify({
-                "success": True,
-                "url": url,
-                "qr_code": qr_code_base64,
-                "format": "PNG",
-                "customization": customization,
-                "message": "QR code generated successfully"
-            }), 200
-        else:
-            return jsonify({
-                "error": "QR code generation failed",
-                "message": "Failed to generate QR code. Please try again."
-            }), 500
-            
-    except Exception as e:
-        return jsonify({
-            "error": "Internal server error",
-            "message": str(e)
-        }), 500
+    url = g.url
+    
+    # Extract customization options (optional)
+    customization = g.qr_request.get('customization', {})
+    fill_color = customization.get('fill_color', 'black')
+    back_color = customization.get('back_color', 'white')
+    pattern = customization.get('pattern', 'square')
+    error_correction = customization.get('error_correction', 'L')
+    logo = customization.get('logo')
+    logo_size = customization.get('logo_size', 0.3)
+    
+    # Generate QR code with customization
+    qr_code_bytes = generate_qr_png(
+        url=url,
+        fill_color=fill_color,
+        back_color=back_color,
+        pattern=pattern,
+        error_correction=error_correction,
+        logo=logo,
+        logo_size=logo_size
+    )
+    
+    if qr_code_bytes:
+        qr_code_base64 = binascii.b2a_base64(qr_code_bytes, newline=False).decode('ascii')
+        # Log QR generation with customization info
+        run_background(log_qr_generation(url, request.user["id"], customization, qr_png=qr_code_bytes))
+        return respond({
+            "success": True,
+            "url": url,
+            "qr_code": qr_code_base64,
+            "format": "PNG",
+            "customization": customization,
+            "message": "QR code generated successfully"
+        }, 200)
+    else:
+        return respond({
+            "error": "QR code generation failed",
+            "message": "Failed to generate QR code. Please try again."
+        }, 500)
 
 
 @app.route('/generate/image', methods=['POST'])
 @require_user
+@require_valid_url
 def generate_qr_code_image():
     """
     Generate QR code and return as image file with customization options
@@ -577,81 +816,53 @@ def generate_qr_code_image():
     Returns:
         PNG image file
     """
-    try:
-        # Get JSON data from request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                "error": "No data provided",
-                "message": "Please provide a JSON object with 'url' field"
-            }), 400
-        
-        url = data.get('url')
-        
-        if not url:
-            return jsonify({
-                "error": "URL is required",
-                "message": "Please provide a 'url' field in the request body"
-            }), 400
-        
-        # Validate URL format
-        if not validate_url(url):
-            return jsonify({
-                "error": "Invalid URL format",
-                "message": "Please provide a valid URL (e.g., https://www.example.com)"
-            }), 400
-        
-        # Extract customization options (optional)
-        customization = data.get('customization', {})
-        fill_color = customization.get('fill_color', 'black')
-        back_color = customization.get('back_color', 'white')
-        pattern = customization.get('pattern', 'square')
-        error_correction = customization.get('error_correction', 'L')
-        logo = customization.get('logo')
-        logo_size = customization.get('logo_size', 0.3)
-        
-        # Generate QR code with customization
-        qr_code_bytes = qr_service.generate_qr_code(
-            url=url,
-            fill_color=fill_color,
-            back_color=back_color,
-            pattern=pattern,
-            error_correction=error_correction,
-            logo=logo,
-            logo_size=logo_size
+    url = g.url
+    
+    # Extract customization options (optional)
+    customization = g.qr_request.get('customization', {})
+    fill_color = customization.get('fill_color', 'black')
+    back_color = customization.get('back_color', 'white')
+    pattern = customization.get('pattern', 'square')
+    error_correction = customization.get('error_correction', 'L')
+    logo = customization.get('logo')
+    logo_size = customization.get('logo_size', 0.3)
+    
+    # Generate QR code with customization
+    qr_code_bytes = generate_qr_png(
+        url=url,
+        fill_color=fill_color,
+        back_color=back_color,
+        pattern=pattern,
+        error_correction=error_correction,
+        logo=logo,
+        logo_size=logo_size
+    )
+    
+    if qr_code_bytes:
+        # Log QR generation with customization info
+        run_background(log_qr_generation(url, request.user["id"], customization, qr_png=qr_code_bytes))
+        # A bytes body goes straight to the WSGI iterable with Content-Length set
+        return Response(
+            qr_code_bytes,
+            mimetype='image/png',
+            headers={'Content-Disposition': 'attachment; filename=qrcode.png'}
         )
-        
-        if qr_code_bytes:
-            # Log QR generation with customization info
-            asyncio.run(log_qr_generation(url, request.user["id"], customization))
-            return send_file(
-                BytesIO(qr_code_bytes),
-                mimetype='image/png',
-                as_attachment=True,
-                download_name='qrcode.png'
-            )
-        else:
-            return jsonify({
-                "error": "QR code generation failed",
-                "message": "Failed to generate QR code. Please try again."
-            }), 500
-            
-    except Exception as e:
-        return jsonify({
-            "error": "Internal server error",
-            "message": str(e)
-        }), 500
+    else:
+        return respond({
+            "error": "QR code generation failed",
+            "message": "Failed to generate QR code. Please try again."
+        }, 500)
 
 
 @app.route('/generate/<path:url>', methods=['GET'])
 @require_user
-def generate_qr_code_get(url):
+@require_valid_url
+def generate_qr_code_get():
     """
     Generate QR code from URL via GET request with customization via query params
     
-    Args:
-        url: URL to encode (passed as path parameter)
+    Path Parameters:
+        url: URL to encode (https:// is assumed when no scheme is given)
     
     Query Parameters (all optional):
         fill_color: Hex color for QR code foreground (e.g., %23FF0000 for red)
@@ -662,72 +873,47 @@ def generate_qr_code_get(url):
     Returns:
         PNG image file
     """
-    try:
-        # Decode URL if needed
-        if not url.startswith('http://') and not url.startswith('https://'):
-            url = 'https://' + url
-        
-        # Validate URL format
-        if not validate_url(url):
-            return jsonify({
-                "error": "Invalid URL format",
-                "message": "Please provide a valid URL"
-            }), 400
-        
-        # Extract customization from query parameters
-        fill_color = request.args.get('fill_color', 'black')
-        back_color = request.args.get('back_color', 'white')
-        pattern = request.args.get('pattern', 'square')
-        error_correction = request.args.get('error_correction', 'L')
-        
-        # URL decode colors if they start with %23 (encoded #)
-        if fill_color.startswith('%23'):
-            fill_color = '#' + fill_color[3:]
-        if back_color.startswith('%23'):
-            back_color = '#' + back_color[3:]
-        
-        # Build customization dict for logging
-        customization = {
-            'fill_color': fill_color,
-            'back_color': back_color,
-            'pattern': pattern,
-            'error_correction': error_correction
-        }
-        
-        # Generate QR code with customization
-        qr_code_bytes = qr_service.generate_qr_code(
-            url=url,
-            fill_color=fill_color,
-            back_color=back_color,
-            pattern=pattern,
-            error_correction=error_correction
-        )
-        
-        if qr_code_bytes:
-            asyncio.run(log_qr_generation(url, request.user["id"], customization))
-            return send_file(
-                BytesIO(qr_code_bytes),
-                mimetype='image/png',
-                as_attachment=False
-            )
-        else:
-            return jsonify({
-                "error": "QR code generation failed",
-                "message": "Failed to generate QR code. Please try again."
-            }), 500
-            
-    except Exception as e:
-        return jsonify({
-            "error": "Internal server error",
-            "message": str(e)
-        }), 500
+    url = g.url
+    
+    # Extract customization from query parameters
+    fill_color = request.args.get('fill_color', 'black')
+    back_color = request.args.get('back_color', 'white')
+    pattern = request.args.get('pattern', 'square')
+    error_correction = request.args.get('error_correction', 'L')
+    
+    # URL decode colors if they start with %23 (encoded #)
+    if fill_color.startswith('%23'):
+        fill_color = '#' + fill_color[3:]
+    if back_color.startswith('%23'):
+        back_color = '#' + back_color[3:]
+    
+    # Build customization dict for logging
+    customization = {
+        'fill_color': fill_color,
+        'back_color': back_color,
+        'pattern': pattern,
+        'error_correction': error_correction
+    }
+    
+    # Generate QR code with customization
+    qr_code_bytes = generate_qr_png(
+        url=url,
+        fill_color=fill_color,
+        back_color=back_color,
+        pattern=pattern,
+        error_correction=error_correction
+    )
+    
+    if qr_code_bytes:
+        run_background(log_qr_generation(url, request.user["id"], customization, qr_png=qr_code_bytes))
+        return Response(qr_code_bytes, mimetype='image/png')
+    else:
+        return respond({
+            "error": "QR code generation failed",
+            "message": "Failed to generate QR code. Please try again."
+        }, 500)
 
 
 if __name__ == "__main__":
-    print("Starting QR Code API Service...")
-    print("API Endpoints:")
-    print("  POST /generate - Generate QR code (returns JSON with base64)")
-    print("  POST /generate/image - Generate QR code (returns PNG image)")
-    print("  GET /generate/<url> - Generate QR code via GET (returns PNG image)")
-    print("  GET /health - Health check")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Local development only; production runs under gunicorn (see wsgi.py)
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
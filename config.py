@@ -3,10 +3,32 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+CPU_COUNT = os.cpu_count() or 1
+# Matches gunicorn_conf.workers, so the render pools split the cores between workers
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", CPU_COUNT * 2 + 1))
+
 class Config:
     MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
     DATABASE_NAME = os.getenv("DATABASE_NAME", "qr_code_generator")
+    # Wire compression, in preference order; the server picks the first it supports
+    MONGODB_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "zstd,zlib")
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-for-jwt-if-needed")
+    REDIS_URL = os.getenv("REDIS_URL")  # Optional; enables the shared QR image and history caches
+    # QR render processes per app worker
+    QR_RENDER_PROCESSES = int(os.getenv("QR_RENDER_PROCESSES", max(1, CPU_COUNT // WEB_CONCURRENCY)))
+    QR_CACHE_TTL = int(os.getenv("QR_CACHE_TTL", "86400"))
+    QR_HISTORY_CACHE_TTL = int(os.getenv("QR_HISTORY_CACHE_TTL", "30"))
+    # Seconds before a slow Redis is treated as a miss and the history comes from Mongo
+    REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.25"))
+    # nginx `internal` location aliased to uploads/, e.g. "/internal-uploads"
+    UPLOADS_ACCEL_PREFIX = os.getenv("UPLOADS_ACCEL_PREFIX")
+    # Public base for ad images when nginx/CDN serves uploads/ directly, e.g.
+    # "https://cdn.example.com/uploads" behind `location /uploads/ { alias .../uploads/; sendfile on; expires 7d; }`
+    PUBLIC_UPLOADS_BASE = os.getenv("PUBLIC_UPLOADS_BASE", "").rstrip("/") or None
+    # External base URL of this API, e.g. "https://api.example.com"; saves deriving it per request
+    PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/") or None
+    # Comma-separated browser origins allowed by CORS; "*" allows any origin
+    ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "*").split(",") if o.strip()]
     
 config = Config()
 
@@ -1,4 +1,5 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
 from config import config
 
 class Database:
@@ -7,10 +8,48 @@ class Database:
 
     @classmethod
     async def connect_db(cls):
-        cls.client = AsyncIOMotorClient(config.MONGODB_URL)
+        # tz_aware: stored UTC datetimes come back as aware datetimes
+        cls.client = AsyncIOMotorClient(config.MONGODB_URL, tz_aware=True, compressors=config.MONGODB_COMPRESSORS)
         cls.db = cls.client[config.DATABASE_NAME]
         print(f"Connected to MongoDB: {config.DATABASE_NAME}")
 
+    # (collection, keys, options) for every field the services look documents up by
+    INDEXES = [
+        ("ads", "id", {"unique": True}),
+        ("ads", [("placement", 1), ("isActive", 1)], {}),
+        ("users", "id", {"unique": True}),
+        ("users", "email", {"unique": True}),
+        ("otps", "email", {"unique": True}),
+        ("user_logs", [("user_id", 1), ("timestamp", -1)], {}),
+        ("qr_history", [("user_id", 1), ("_id", -1)], {}),
+        ("settings", "type", {"unique": True}),
+    ]
+
+    # (collection, index name) left behind by earlier INDEXES entries; no query uses
+    # them, but every insert would keep maintaining them
+    STALE_INDEXES = [
+        ("qr_history", "user_id_1_timestamp_-1"),  # replaced by (user_id, _id)
+    ]
+
+    # Server error code for dropping an index that does not exist
+    INDEX_NOT_FOUND = 27
+
+    @classmethod
+    async def ensure_indexes(cls):
+        """Create the lookup indexes and drop stale ones; a no-op once in place."""
+        for collection, keys, options in cls.INDEXES:
+            try:
+                await cls.db[collection].create_index(keys, **options)
+            except Exception as e:
+                # e.g. existing duplicates block a unique index; keep serving without it
+                print(f"Could not create index on {collection} {keys}: {e}")
+        for collection, name in cls.STALE_INDEXES:
+            try:
+                await cls.db[collection].drop_index(name)
+            except OperationFailure as e:
+                if e.code != cls.INDEX_NOT_FOUND:
+                    print(f"Could not drop index {name} on {collection}: {e}")
+
     @classmethod
     async def close_db(cls):
         if cls.client:
@@ -0,0 +1,14 @@
+"""
+Gunicorn configuration for the FastAPI app:
+
+    gunicorn -c gunicorn_conf.py main:app
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+# UvicornWorker picks uvloop and httptools automatically when they are installed
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+keepalive = 30
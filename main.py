@@ -1,26 +1,44 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qsl
 import uvicorn
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from fastapi.responses import ORJSONResponse
 from routers import auth, qr, admin
-import json
+import orjson
 
 
+from config import config
 from database import db
+from services.log_writer import flush_log_writers
 
 app = FastAPI(
     title="QR Code Generator API",
     description="API for QR code generation and advertisement management with authentication.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 @app.on_event("startup")
 async def startup_db_client():
+    # CPU-bound QR rendering runs here (see routers.qr.render_qr). Children come
+    # from a forkserver, not a fork of this process with its Motor threads and loop.
+    app.state.qr_pool = ProcessPoolExecutor(
+        max_workers=config.QR_RENDER_PROCESSES,
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
     await db.connect_db()
+    await db.ensure_indexes()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await flush_log_writers()
     await db.close_db()
+    app.state.qr_pool.shutdown()
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,94 +48,192 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.middleware("http")
-async def add_standard_response_fields(request: Request, call_next):
-    
-    response = await call_next(request)
-    
+# /auth/login and /admin/login; a suffix check, so /auth/login-history is not a login
+LOGIN_PATH_SUFFIX = "/login"
 
-    content_type = response.headers.get("Content-Type", "")
-    if "application/json" in content_type:
-      
-        body = b""
-        async for chunk in response.body_iterator:
-            body += chunk
-            
-        try:
-            data = json.loads(body)
-            original_data = data
-            
-       
-            status = "failed" if response.status_code >= 400 else "success"
-            status_code = response.status_code
-            
-         
-            is_login_path = "/login" in request.url.path or "/auth/login" in request.url.path
-            
-            if response.status_code == 200 and is_login_path:
-                message = "login successful"
-            elif response.status_code == 401:
-                if is_login_path:
-                    message = "email/password is wrong"
-                else:
-                    message = "Unauthorized"
-            elif response.status_code >= 400:
-                message = "login failed" if is_login_path else "An error occurred"
+
+def build_standard_response(path: str, status_code: int, data):
+    """Wrap a decoded JSON payload in the status/status_code/message envelope."""
+    status = "failed" if status_code >= 400 else "success"
+
+    is_login_path = path.endswith(LOGIN_PATH_SUFFIX)
+
+    if status_code == 200 and is_login_path:
+        message = "login successful"
+    elif status_code == 401:
+        if is_login_path:
+            message = "email/password is wrong"
+        else:
+            message = "Unauthorized"
+    elif status_code >= 400:
+        message = "login failed" if is_login_path else "An error occurred"
+    else:
+        message = "successful"
+
+    if isinstance(data, dict):
+
+        if "message" in data:
+            message = data.pop("message")
+
+        if "detail" in data and len(data) == 1:
+            detail = data.pop("detail")
+            if status_code == 401:
+                message = "email/password is wrong" if is_login_path else str(detail)
             else:
-                message = "successful"
-            
-            if isinstance(data, dict):
-                
-                if "message" in data:
-                    message = data.pop("message")
-                
-                if "detail" in data and len(data) == 1:
-                    detail = data.pop("detail")
-                    if response.status_code == 401:
-                        message = "email/password is wrong" if is_login_path else str(detail)
-                    else:
-                        message = str(detail)
-                
-                standard_response = {
-                    "status": status,
-                    "status_code": status_code,
-                    "message": message,
-                    **data
-                }
+                message = str(detail)
+
+        return {
+            "status": status,
+            "status_code": status_code,
+            "message": message,
+            **data
+        }
+
+    return {
+        "status": status,
+        "status_code": status_code,
+        "message": message,
+        "data": data
+    }
+
+
+# Set by handlers that already return the envelope, so the middleware skips the rewrite
+ALREADY_STANDARD_HEADER = b"x-already-standard"
+
+
+# Successful JSON bodies with no payload are sent as 204 No Content
+EMPTY_JSON_BODIES = frozenset({b"", b"null"})
+
+
+class StandardResponseMiddleware:
+    """
+    Pure ASGI middleware that rewrites JSON responses into the standard envelope.
+
+    Only JSON bodies are buffered; everything else streams through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        body_chunks = []
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                content_type = b""
+                headers = message.get("headers", [])
+                for name, value in headers:
+                    name = name.lower()
+                    if name == ALREADY_STANDARD_HEADER:
+                        # Body is already an envelope; drop the internal marker and pass through
+                        message = {**message, "headers": [h for h in headers if h[0].lower() != ALREADY_STANDARD_HEADER]}
+                        content_type = b""
+                        break
+                    if name == b"content-type":
+                        content_type = value
+                if b"application/json" in content_type:
+                    start_message = message
+                    return
+                await send(message)
+                return
+
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body_chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(body_chunks)
+            if 200 <= start_message["status"] < 300 and body in EMPTY_JSON_BODIES:
+                # Nothing to wrap: answer 204 without a body or content headers
+                headers = [(k, v) for k, v in start_message.get("headers", []) if k.lower() not in (b"content-length", b"content-type")]
+                await send({**start_message, "status": 204, "headers": headers})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            try:
+                data = orjson.loads(body)
+                body = orjson.dumps(build_standard_response(scope["path"], start_message["status"], data))
+            except Exception:
+                pass  # Fallback to the original body
+
+            headers = [(k, v) for k, v in start_message.get("headers", []) if k.lower() != b"content-length"]
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            await send({**start_message, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class AuthorizationMiddleware:
+    """
+    Pure ASGI middleware that pulls the raw Authorization value off the request.
+
+    The header wins over the ?authorization= query parameter. The value lands in
+    scope["state"]["authorization"] for the auth dependencies to resolve.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            authorization = None
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    authorization = value.decode("latin-1")
+                    break
             else:
-                
-                standard_response = {
-                    "status": status,
-                    "status_code": status_code,
-                    "message": message,
-                    "data": data
-                }
-                
-            new_content = json.dumps(standard_response).encode("utf-8")
-            
-          
-            return JSONResponse(
-                content=standard_response,
-                status_code=response.status_code,
-                headers={k: v for k, v in response.headers.items() if k.lower() != "content-length"}
-            )
-            
-        except Exception:
-       
-            from fastapi.responses import Response
-            return Response(
-                content=body,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                media_type=content_type
-            )
-            
-    return response
+                query_string = scope.get("query_string", b"")
+                if b"authorization=" in query_string:
+                    for name, value in parse_qsl(query_string.decode("latin-1")):
+                        if name == "authorization":
+                            authorization = value
+            scope.setdefault("state", {})["authorization"] = authorization
+
+        await self.app(scope, receive, send)
+
+
+class JSONGZipResponder(GZipResponder):
+    """GZipResponder that only compresses JSON; PNGs and uploaded files pass through."""
+
+    async def send_with_gzip(self, message):
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if "application/json" not in content_type:
+                # Take the branch GZipResponder uses for bodies that are already encoded
+                self.content_encoding_set = True
+
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware restricted to JSON responses (see JSONGZipResponder)."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = JSONGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(AuthorizationMiddleware)
+app.add_middleware(StandardResponseMiddleware)
+# Added last so it is outermost and compresses the final enveloped body
+app.add_middleware(JSONGZipMiddleware, minimum_size=1000, compresslevel=5)
 
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    is_login_path = "/login" in request.url.path or "/auth/login" in request.url.path
+    is_login_path = request.url.path.endswith(LOGIN_PATH_SUFFIX)
     message = str(exc.detail) if hasattr(exc, "detail") else "No detail provided"
     
     
@@ -127,18 +243,19 @@ async def http_exception_handler(request: Request, exc: HTTPException):
        
         pass
 
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "status": "failed",
             "status_code": exc.status_code,
             "message": message,
         },
+        headers={ALREADY_STANDARD_HEADER.decode("latin-1"): "1"},
     )
 
 @app.exception_handler(Exception)
 async def universal_exception_handler(request: Request, exc: Exception):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "status": "error",
@@ -177,4 +294,10 @@ if __name__ == "__main__":
     print("\nDocumentation available at http://192.168.53.163:5000/docs")
     print("\n" + "=" * 50)
     
-    uvicorn.run("main:app", host="0.0.0.0", port=5000, reload=True)
\ No newline at end of file
+    # Local launcher; production runs under gunicorn (see gunicorn_conf.py)
+    reload = os.getenv("APP_ENV") == "development"
+    uvicorn.run("main:app", host="0.0.0.0", port=5000, loop="uvloop", http="httptools",
+                reload=reload,
+                # The reloader supervises a single process; workers only apply without it
+                workers=None if reload else int(os.getenv("WEB_CONCURRENCY", "4")),
+                access_log=reload)
\ No newline at end of file
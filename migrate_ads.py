@@ -1,8 +1,33 @@
-import json
+import hashlib
 import os
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 from config import config
+from utils.ads_store import read_ads_files, replay_ads
+
+INSERT_BATCH_SIZE = 1000
+INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression", "collation")
+
+async def load_ads(db, ads):
+    """Bulk insert ads into the ads collection."""
+    # Unordered, pre-split batches: the server can apply each batch in
+    # parallel and one bad document doesn't abort the rest
+    for start in range(0, len(ads), INSERT_BATCH_SIZE):
+        await db.ads.insert_many(
+            ads[start:start + INSERT_BATCH_SIZE],
+            ordered=False,
+            bypass_document_validation=True
+        )
+
+
+async def restore_indexes(db, indexes):
+    """Recreate the non-_id indexes captured with index_information()."""
+    for name, info in indexes.items():
+        if name == "_id_":
+            continue
+        options = {key: info[key] for key in INDEX_OPTIONS if key in info}
+        await db.ads.create_index(info["key"], name=name, **options)
+
 
 async def migrate_ads():
     
@@ -12,27 +37,49 @@ async def migrate_ads():
     
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
     ADS_DATA_FILE = os.path.join(BASE_DIR, "ads_data.json")
+    ADS_LOG_FILE = os.path.join(BASE_DIR, "ads_data.log.jsonl")
     
-    if os.path.exists(ADS_DATA_FILE):
-        print(f"Reading ads from {ADS_DATA_FILE}...")
+    if os.path.exists(ADS_DATA_FILE) or os.path.exists(ADS_LOG_FILE):
+        print(f"Reading ads from {ADS_DATA_FILE} and {ADS_LOG_FILE}...")
         try:
-            with open(ADS_DATA_FILE, "r", encoding="utf-8") as fh:
-                ads = json.load(fh)
-            
-            if ads:
+            # Same view the Flask service loads: snapshot plus uncompacted mutations
+            snapshot, log = read_ads_files(ADS_DATA_FILE, ADS_LOG_FILE)
+            ads = list(replay_ads(snapshot, log).values())
+
+            # Re-running with unchanged files is a no-op instead of a full reload
+            content_hash = hashlib.sha256(snapshot + b"\0" + log).hexdigest()
+            meta = await db.migrations.find_one({"_id": "ads"})
+            if meta and meta.get("hash") == content_hash:
+                print("Ads already migrated from these files. Skipping.")
+            elif ads:
                 print(f"Migrating {len(ads)} ads to MongoDB...")
                 
-                await db.ads.delete_many({})
-                
-                
-                await db.ads.insert_many(ads)
+                # Load into a bare collection and rebuild indexes once at the end:
+                # a sorted index build is far cheaper than per-document updates
+                indexes = await db.ads.index_information()
+                await db.ads.drop()
+                try:
+                    await load_ads(db, ads)
+                finally:
+                    await restore_indexes(db, indexes)
+                # Continue id allocation after the highest migrated id
+                await db.counters.update_one(
+                    {"_id": "ads"},
+                    {"$set": {"seq": max((ad.get("id", 0) for ad in ads), default=0)}},
+                    upsert=True
+                )
+                await db.migrations.update_one(
+                    {"_id": "ads"},
+                    {"$set": {"hash": content_hash}},
+                    upsert=True
+                )
                 print("Migration successful!")
             else:
                 print("No ads found in JSON file.")
         except Exception as e:
             print(f"Migration failed: {e}")
     else:
-        print("JSON ads file not found. Skipping migration.")
+        print("Ads snapshot and log not found. Skipping migration.")
         
     client.close()
 
@@ -16,8 +16,25 @@ from qrcode.image.styles.colormasks import SolidFillColorMask
 from io import BytesIO
 from typing import Optional, Union, Tuple
 import base64
+import binascii
+import hashlib
+import threading
+from functools import lru_cache
+from cachetools import LRUCache
 from PIL import Image, ImageDraw
 
+# segno writes plain square-module PNGs directly, without going through PIL
+try:
+    import segno
+except ImportError:
+    segno = None
+
+# libvips encodes PNG faster than PIL and releases the GIL while doing it
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
+
 
 class QRCodeService:
     """Service for generating QR codes from URLs with customization options"""
@@ -39,6 +56,9 @@ class QRCodeService:
         'H': qrcode.constants.ERROR_CORRECT_H   # 30% recovery
     }
     
+    # Upper bound on the PNG bytes kept in the rendered image cache
+    IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    
     def __init__(self, box_size: int = 10, border: int = 4):
         """
         Initialize QR Code Service
@@ -49,6 +69,15 @@ class QRCodeService:
         """
         self.box_size = box_size
         self.border = border
+        # Rendered images keyed by every generation option; output is deterministic.
+        # Bounded by total PNG bytes since logo/large-box images dwarf plain ones.
+        self._image_cache = LRUCache(maxsize=self.IMAGE_CACHE_MAX_BYTES, getsizeof=len)
+        self._image_cache_lock = threading.Lock()
+        # Decoded logos keyed by digest; callers get copies since embedding resizes in place
+        self._logo_cache = LRUCache(maxsize=256)
+        # Per-thread drawer/mask instances: StyledPilImage re-initializes them for
+        # each image, so they can be reused but not shared between threads
+        self._styles = threading.local()
     
     
     # Color name to RGB mapping
@@ -70,7 +99,8 @@ class QRCodeService:
     }
     
     
-    def _hex_to_rgb(self, hex_color: str) -> Tuple[int, int, int]:
+    @staticmethod
+    def _hex_to_rgb(hex_color: str) -> Tuple[int, int, int]:
         """Convert hex color to RGB tuple"""
         hex_color = hex_color.lstrip('#')
         if len(hex_color) == 3:
@@ -79,6 +109,71 @@ class QRCodeService:
         return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
     
     def _parse_color(self, color: Union[str, Tuple[int, int, int]]) -> Tuple[int, int, int]:
+        """Parse a color, memoizing the result for string inputs."""
+        if isinstance(color, str):
+            return self._parse_color_str(color)
+        return self._parse_color_uncached(color)
+
+    # A static method so the cache is not keyed on (and does not keep alive) instances
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _parse_color_str(color: str) -> Tuple[int, int, int]:
+        return QRCodeService._parse_color_uncached(color)
+
+    def _module_drawer(self, pattern: str):
+        """Reusable module drawer for pattern, one instance per thread."""
+        drawers = getattr(self._styles, "drawers", None)
+        if drawers is None:
+            drawers = self._styles.drawers = {}
+        drawer = drawers.get(pattern)
+        if drawer is None:
+            drawer = drawers[pattern] = self.PATTERN_STYLES[pattern]()
+        return drawer
+
+    def _qr_code(self, error_correction: str) -> qrcode.QRCode:
+        """Cleared QRCode for an error correction level, reused per thread."""
+        codes = getattr(self._styles, "qr_codes", None)
+        if codes is None:
+            codes = self._styles.qr_codes = {}
+        qr = codes.get(error_correction)
+        if qr is None:
+            qr = codes[error_correction] = qrcode.QRCode(
+                version=1,
+                error_correction=self.ERROR_CORRECTION_LEVELS[error_correction],
+                box_size=self.box_size,
+                border=self.border,
+            )
+        else:
+            qr.clear()
+            qr.version = 1  # clear() keeps the last fitted version; fit from 1 again
+        return qr
+
+    def _square_image(self, qr: qrcode.QRCode, fill_color: Tuple[int, int, int], back_color: Tuple[int, int, int]) -> Image.Image:
+        """
+        Render square modules in bulk instead of one draw call per module.
+
+        Builds a one-pixel-per-module palette image (border included) and scales
+        it up with NEAREST, which gives the same pixels as SquareModuleDrawer.
+        """
+        matrix = qr.get_matrix()
+        size = len(matrix)
+        modules = Image.frombytes('P', (size, size), bytes(cell for row in matrix for cell in row))
+        modules.putpalette(back_color + fill_color)
+        scaled = size * self.box_size
+        return modules.resize((scaled, scaled), Image.NEAREST).convert('RGB')
+
+    def _color_mask(self, back_color: Tuple[int, int, int], fill_color: Tuple[int, int, int]):
+        """Reusable solid color mask for a color pair, one instance per thread."""
+        masks = getattr(self._styles, "masks", None)
+        if masks is None:
+            masks = self._styles.masks = {}
+        mask = masks.get((back_color, fill_color))
+        if mask is None:
+            mask = masks[(back_color, fill_color)] = SolidFillColorMask(back_color=back_color, front_color=fill_color)
+        return mask
+
+    @staticmethod
+    def _parse_color_uncached(color: Union[str, Tuple[int, int, int]]) -> Tuple[int, int, int]:
         """
         Parse and validate color input, always returning RGB tuple
         
@@ -91,15 +186,15 @@ class QRCodeService:
         if isinstance(color, str):
             # Convert color names to RGB tuples
             color_lower = color.lower()
-            if color_lower in self.COLOR_MAP:
-                return self.COLOR_MAP[color_lower]
+            if color_lower in QRCodeService.COLOR_MAP:
+                return QRCodeService.COLOR_MAP[color_lower]
             
             # Convert hex color to RGB
             if not color.startswith('#'):
                 color = f'#{color}'
             if len(color) not in [4, 7]:  # #RGB or #RRGGBB
                 raise ValueError(f"Invalid hex color format: {color}")
-            return self._hex_to_rgb(color)
+            return QRCodeService._hex_to_rgb(color)
         elif isinstance(color, (list, tuple)) and len(color) == 3:
             # Validate RGB tuple
             if not all(0 <= c <= 255 for c in color):
@@ -118,6 +213,12 @@ class QRCodeService:
         Returns:
             PIL Image object or None
         """
+        key = hashlib.blake2b(logo_data.encode(), digest_size=16).digest()
+        with self._image_cache_lock:
+            logo_image = self._logo_cache.get(key)
+        if logo_image is not None:
+            return logo_image.copy()
+
         try:
             # Remove data URL prefix if present
             if ',' in logo_data:
@@ -130,8 +231,12 @@ class QRCodeService:
             # Convert to RGBA for transparency support
             if logo_image.mode != 'RGBA':
                 logo_image = logo_image.convert('RGBA')
-            
-            return logo_image
+            else:
+                logo_image.load()  # Detach from the BytesIO before caching
+
+            with self._image_cache_lock:
+                self._logo_cache[key] = logo_image
+            return logo_image.copy()
         except Exception as e:
             print(f"Error decoding logo: {str(e)}")
             return None
@@ -188,6 +293,50 @@ class QRCodeService:
             print(f"Error embedding logo: {str(e)}")
             return qr_img
     
+    def _cache_key(self, url, format, fill_color, back_color, pattern, error_correction, logo, logo_size):
+        """Hashable cache key; logos are keyed by digest so large uploads aren't retained."""
+        if isinstance(fill_color, list):
+            fill_color = tuple(fill_color)
+        if isinstance(back_color, list):
+            back_color = tuple(back_color)
+        logo_digest = hashlib.blake2b(logo.encode(), digest_size=16).digest() if logo else None
+        return (url, format, fill_color, back_color, pattern, error_correction, logo_digest, logo_size)
+
+    def get_cached_qr_code(self,
+                  url: str,
+                  format: str = 'PNG',
+                  fill_color: Union[str, Tuple[int, int, int]] = "black",
+                  back_color: Union[str, Tuple[int, int, int]] = "white",
+                  pattern: str = 'square',
+                  error_correction: str = 'L',
+                  logo: Optional[str] = None,
+                  logo_size: float = 0.3) -> Optional[bytes]:
+        """Return the cached image for these options, or None if it was never rendered."""
+        try:
+            key = self._cache_key(url, format, fill_color, back_color, pattern, error_correction, logo, logo_size)
+        except (TypeError, AttributeError):
+            return None
+        with self._image_cache_lock:
+            return self._image_cache.get(key)
+
+    def cache_qr_code(self,
+                      img_bytes: bytes,
+                      url: str,
+                      format: str = 'PNG',
+                      fill_color: Union[str, Tuple[int, int, int]] = "black",
+                      back_color: Union[str, Tuple[int, int, int]] = "white",
+                      pattern: str = 'square',
+                      error_correction: str = 'L',
+                      logo: Optional[str] = None,
+                      logo_size: float = 0.3) -> None:
+        """Remember an image rendered elsewhere (e.g. in a worker process) for these options."""
+        try:
+            key = self._cache_key(url, format, fill_color, back_color, pattern, error_correction, logo, logo_size)
+        except (TypeError, AttributeError):
+            return
+        with self._image_cache_lock:
+            self._image_cache[key] = img_bytes
+
     def generate_qr_code(self, 
                         url: str, 
                         format: str = 'PNG',
@@ -198,6 +347,42 @@ class QRCodeService:
                         logo: Optional[str] = None,
                         logo_size: float = 0.3) -> Optional[bytes]:
         """
+        Generate customized QR code from URL, reusing a previously rendered image
+        when the same options were requested before.
+
+        Takes the same arguments as _render_qr_code.
+
+        Returns:
+            Bytes of the generated QR code image, or None if error
+        """
+        img_bytes = self.get_cached_qr_code(
+            url, format, fill_color, back_color,
+            pattern, error_correction, logo, logo_size
+        )
+        if img_bytes is not None:
+            return img_bytes
+
+        img_bytes = self._render_qr_code(
+            url, format, fill_color, back_color,
+            pattern, error_correction, logo, logo_size
+        )
+        if img_bytes:
+            self.cache_qr_code(
+                img_bytes, url, format, fill_color, back_color,
+                pattern, error_correction, logo, logo_size
+            )
+        return img_bytes
+
+    def _render_qr_code(self, 
+                        url: str, 
+                        format: str = 'PNG',
+                        fill_color: Union[str, Tuple[int, int, int]] = "black",
+                        back_color: Union[str, Tuple[int, int, int]] = "white",
+                        pattern: str = 'square',
+                        error_correction: str = 'L',
+                        logo: Optional[str] = None,
+                        logo_size: float = 0.3) -> Optional[bytes]:
+        """
         Generate customized QR code from URL
         
         Args:
@@ -236,29 +421,35 @@ class QRCodeService:
                 error_correction = 'H'
                 print("Automatically using error correction 'H' for logo embedding")
             
+            # Fast path for the common plain QR: square modules, no logo, PNG
+            if segno is not None and pattern == 'square' and not logo and format.upper() == 'PNG':
+                qr = segno.make_qr(url, error=error_correction.lower(), boost_error=False)
+                img_buffer = BytesIO()
+                qr.save(img_buffer, kind='png', scale=self.box_size, border=self.border,
+                        dark=fill_color, light=back_color)
+                return img_buffer.getvalue()
+
             # Create QR code instance
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=self.ERROR_CORRECTION_LEVELS[error_correction],
-                box_size=self.box_size,
-                border=self.border,
-            )
+            qr = self._qr_code(error_correction)
             
             qr.add_data(url)
             qr.make(fit=True)
             
-            # Get pattern drawer
-            module_drawer = self.PATTERN_STYLES[pattern]()
-            
-            # Create color mask
-            color_mask = SolidFillColorMask(back_color=back_color, front_color=fill_color)
-            
-            # Generate image with style
-            img = qr.make_image(
-                image_factory=StyledPilImage,
-                module_drawer=module_drawer,
-                color_mask=color_mask
-            )
+            if pattern == 'square':
+                img = self._square_image(qr, fill_color, back_color)
+            else:
+                # Get pattern drawer
+                module_drawer = self._module_drawer(pattern)
+                
+                # Create color mask
+                color_mask = self._color_mask(back_color, fill_color)
+                
+                # Generate image with style
+                img = qr.make_image(
+                    image_factory=StyledPilImage,
+                    module_drawer=module_drawer,
+                    color_mask=color_mask
+                )
             
             # Convert to RGB/RGBA for further processing
             if img.mode not in ['RGB', 'RGBA']:
@@ -271,6 +462,13 @@ class QRCodeService:
                     img = self._embed_logo(img, logo_img, logo_size)
             
             # Convert to bytes
+            if pyvips is not None and format.upper() == 'PNG':
+                width, height = img.size
+                vips_img = pyvips.Image.new_from_memory(
+                    img.tobytes(), width, height, len(img.getbands()), 'uchar'
+                )
+                return vips_img.write_to_buffer('.png[compression=6]')
+
             img_buffer = BytesIO()
             
             # Convert RGBA to RGB for formats that don't support transparency
@@ -323,7 +521,8 @@ class QRCodeService:
             pattern, error_correction, logo, logo_size
         )
         if img_bytes:
-            return base64.b64encode(img_bytes).decode('utf-8')
+            # One C-level encode; ASCII decode of base64 output is a straight copy
+            return binascii.b2a_base64(img_bytes, newline=False).decode('ascii')
         return None
     
     def save_qr_code(self, 
@@ -368,6 +567,21 @@ class QRCodeService:
             return False
 
 
+_worker_service = None
+
+
+def render_qr_code(**options) -> Optional[bytes]:
+    """
+    Process-pool entry point: render a QR image with this process's own service.
+
+    The calling process keeps the image cache, so this always renders.
+    """
+    global _worker_service
+    if _worker_service is None:
+        _worker_service = QRCodeService()
+    return _worker_service._render_qr_code(**options)
+
+
 if __name__ == "__main__":
     service = QRCodeService()
     
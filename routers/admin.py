@@ -1,21 +1,17 @@
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
 from pydantic import BaseModel
 from typing import Optional
 from services.admin_service import AdminService
-from utils.jwt_utils import create_access_token, decode_access_token
+from utils.admin_auth import check_admin_credentials
+from utils.jwt_utils import create_access_token, decode_access_token, extract_bearer_token
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
-ADMIN_USERNAME = "admin@123"
-ADMIN_PASSWORD = "1234"
-
 class AdminLoginRequest(BaseModel):
     username: str
     password: str
 
-from fastapi import APIRouter, Depends, HTTPException, Header, Query
-
 async def get_current_admin(
     authorization: Optional[str] = Header(None),
     auth_query: Optional[str] = Query(None, alias="authorization")
@@ -24,13 +20,9 @@ async def get_current_admin(
     if not token_str:
         raise HTTPException(status_code=401, detail="Missing Authorization header or authorization query parameter")
     
-    if token_str.lower().startswith("bearer "):
-        parts = token_str.split()
-        if len(parts) != 2:
-            raise HTTPException(status_code=401, detail="Invalid authorization format")
-        token = parts[1]
-    else:
-        token = token_str
+    token = extract_bearer_token(token_str)
+    if not token:
+        raise HTTPException(status_code=401, detail="Invalid authorization format")
         
     payload = decode_access_token(token)
     if not payload or payload.get("role") != "admin":
@@ -55,20 +47,10 @@ async def get_stats(admin: dict = Depends(get_current_admin)):
 @router.post("/login")
 async def admin_login(body: AdminLoginRequest):
     """Admin login endpoint (matches Flask service behavior)."""
-    if body.username != ADMIN_USERNAME or body.password != ADMIN_PASSWORD:
+    if not check_admin_credentials(body.username, body.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    from services.auth_service import find_user_by_email, create_user
-    admin_user = await find_user_by_email(body.username)
-    
-    if not admin_user:
-        admin_user = await create_user(
-            name="Admin",
-            email=body.username,
-            role="admin"
-        )
-    
-    mongo_id = admin_user.get("mongo_id")
+    mongo_id = await AdminService.get_admin_mongo_id(body.username)
     
     token = create_access_token(data={
         "sub": body.username,
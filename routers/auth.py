@@ -1,23 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends, Header, Query
+import hashlib
+import time
+from cachetools import TTLCache
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from services.auth_service import (
-    find_user_by_email,
-    create_user,
+    get_or_create_user,
     generate_otp,
     save_otp,
     verify_otp,
     find_user_by_id,
+    find_user_by_mongo_id,
     log_user_login,
-    get_user_login_history,
-    create_google_user
+    get_user_login_history
 )
 from services.email_service import send_otp_email
-from utils.jwt_utils import create_access_token, decode_access_token
+from utils.jwt_utils import create_access_token, decode_access_token, extract_bearer_token
 
 router = APIRouter(tags=["Auth"])
 user_router = APIRouter(tags=["Users"])
 
+# Authenticated users keyed by token digest; entries also honour the token's exp.
+# Only successful lookups are stored, so bad tokens are re-checked every time.
+_authenticated_users = TTLCache(maxsize=10000, ttl=30)
+
 
 # =======================
 # Request Models
@@ -63,31 +70,52 @@ class GoogleAuthRequest(BaseModel):
 # Dependencies
 # =======================
 
-async def get_current_user(
-    authorization: Optional[str] = Header(None),
-    auth_query: Optional[str] = Query(None, alias="authorization")
-):
-    token_str = authorization or auth_query
+async def authenticate_token(token: str) -> Optional[dict]:
+    """
+    Resolve a bearer token to its user.
+    Returns None for an invalid or expired token and {} when the user no longer exists.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    entry = _authenticated_users.get(key)
+    if entry is not None and entry[1] > time.time():
+        return dict(entry[0])
+
+    payload = decode_access_token(token)
+    if not payload or "sub" not in payload:
+        return None
+
+    user = await find_user_by_id(payload["sub"])
+    if not user:
+        return {}
+    _authenticated_users[key] = (dict(user), payload["exp"])
+    return user
+
+
+def get_authorization(request: Request) -> Optional[str]:
+    """Raw Authorization value captured by AuthorizationMiddleware."""
+    return request.scope.get("state", {}).get("authorization")
+
+
+async def get_current_user(request: Request):
+    token_str = get_authorization(request)
     if not token_str:
         raise HTTPException(status_code=401, detail="Missing Authorization header or authorization query parameter")
     
+    user = request.scope["state"].get("user")
+    if user:
+        return user
+
     try:
-        if token_str.lower().startswith("bearer "):
-            parts = token_str.split()
-            if len(parts) != 2:
-                raise HTTPException(status_code=401, detail="Invalid authorization format")
-            token = parts[1]
-        else:
-            token = token_str  
+        token = extract_bearer_token(token_str)
+        if not token:
+            raise HTTPException(status_code=401, detail="Invalid authorization format")
         
-        payload = decode_access_token(token)
-        if not payload or "sub" not in payload:
+        user = await authenticate_token(token)
+        if user is None:
              raise HTTPException(status_code=401, detail="Invalid or expired token")
-        
-        user_id = payload["sub"]
-        user = await find_user_by_id(user_id)
         if not user:
              raise HTTPException(status_code=401, detail="User not found")
+        request.scope["state"]["user"] = user
         return user
     except HTTPException:
         raise
@@ -95,206 +123,141 @@ async def get_current_user(
         raise HTTPException(status_code=401, detail="Authentication failed")
 
 
-async def get_current_user_optional(
-    authorization: Optional[str] = Header(None),
-    auth_query: Optional[str] = Query(None, alias="authorization")
-) -> Optional[dict]:
-    token_str = authorization or auth_query
+async def get_current_user_optional(request: Request) -> Optional[dict]:
+    token_str = get_authorization(request)
     if not token_str:
         return None
     
+    user = request.scope["state"].get("user")
+    if user:
+        return user
+
     try:
-        if token_str.lower().startswith("bearer "):
-            parts = token_str.split()
-            if len(parts) != 2:
-                return None
-            token = parts[1]
-        else:
-            token = token_str
+        token = extract_bearer_token(token_str)
+        if not token:
+            return None
         
-        payload = decode_access_token(token)
-        if not payload or "sub" not in payload:
-             return None
-        
-        user_id = payload["sub"]
-        user = await find_user_by_id(user_id)
+        user = await authenticate_token(token) or None
+        if user:
+            request.scope["state"]["user"] = user
         return user
     except Exception:
         return None
 
 
+def build_login_response(user: dict, message: str, default_login_type: str = "email") -> dict:
+    """Access token plus public user fields; the JWT claims come from the same view."""
+    user_view = {
+        "id": user["id"],
+        "mongo_id": user.get("mongo_id"),
+        "name": user.get("name"),
+        "email": user["email"],
+        "profile_pic": user.get("profile_pic"),
+        "login_type": user.get("login_type", default_login_type),
+        "role": user.get("role", "user"),
+        "created_at": user.get("created_at")
+    }
+    access_token = create_access_token(data={
+        "sub": user_view["id"],
+        "mongo_id": user_view["mongo_id"],
+        "name": user_view["name"],
+        "email": user_view["email"],
+        "role": user_view["role"]
+    })
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "message": message,
+        "user": user_view
+    }
+
+
 # =======================
 # Send OTP (For Register/Login)
 # =======================
 
 @router.post("/send-otp")
-async def send_otp(body: SendOTPRequest):
+async def send_otp(body: SendOTPRequest, background_tasks: BackgroundTasks):
     """Send an OTP code to the user's email for verification."""
     otp = generate_otp()
     await save_otp(body.email, otp)
 
-    try:
-        success = send_otp_email(body.email, otp, purpose="verification")
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to send email. Please check server logs.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
-    
-    print(f"✅ OTP sent to {body.email}: {otp}")  
+    # SMTP is blocking; BackgroundTasks runs it in the threadpool after the response
+    background_tasks.add_task(deliver_otp_email, body.email, otp)
 
     return {"message": "OTP sent to your email. Please check your inbox."}
 
 
+def deliver_otp_email(email: str, otp: str):
+    """Send the OTP email outside the request; failures can only be logged."""
+    try:
+        if not send_otp_email(email, otp, purpose="verification"):
+            print(f"❌ Failed to send OTP email to {email}")
+    except Exception as e:
+        print(f"❌ Failed to send OTP email to {email}: {e}")
+
+
 @router.post("/verify-otp")
-async def verify_otp_route(body: VerifyOTPRequest):
+async def verify_otp_route(body: VerifyOTPRequest, background_tasks: BackgroundTasks):
     """Verify the OTP code sent to the user's email and return a token."""
     if not await verify_otp(body.email, body.otp):
         raise HTTPException(status_code=400, detail="Invalid or expired OTP")
     
-    user = await find_user_by_email(body.email)
+    user, created = await get_or_create_user(
+        email=body.email,
+        name=body.email.split('@')[0],
+        login_type="email"
+    )
+    message = "User registered and verified successfully" if created else "OTP verified successfully"
     
     
-    if not user:
-        user = await create_user(
-            name=body.email.split('@')[0], 
-            email=body.email,
-            login_type="email"
-        )
-        message = "User registered and verified successfully"
-    else:
-        message = "OTP verified successfully"
-    
-    
-    await log_user_login(user["id"], user["email"], user.get("login_type", "email"))
+    background_tasks.add_task(log_user_login, user["id"], user["email"], user.get("login_type", "email"))
 
     
-    access_token = create_access_token(data={
-        "sub": user["id"],
-        "mongo_id": user.get("mongo_id"),
-        "name": user.get("name"),
-        "email": user["email"],
-        "role": user.get("role", "user")
-    })
-
-   
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "message": message,
-        "user": {
-            "id": user["id"],
-            "mongo_id": user.get("mongo_id"),
-            "name": user.get("name"),
-            "email": user["email"],
-            "profile_pic": user.get("profile_pic"),
-            "login_type": user.get("login_type", "email"),
-            "role": user.get("role", "user"),
-            "created_at": user.get("created_at")
-        }
-    }
+    return ORJSONResponse(content=build_login_response(user, message))
 
 
 @router.post("/login")
-async def login(body: LoginRequest):
+async def login(body: LoginRequest, background_tasks: BackgroundTasks):
     """Verify OTP and login. Creates a new user if one doesn't exist."""
     
     if not await verify_otp(body.email, body.otp):
         raise HTTPException(status_code=400, detail="Invalid or expired OTP")
     
-    user = await find_user_by_email(body.email)
-    
-    
-    if not user:
-        user = await create_user(
-            name=body.email.split('@')[0], 
-            email=body.email,
-            login_type="email"
-        )
-        message = "User registered and logged in successfully"
-    else:
-        message = "Logged in successfully"
+    user, created = await get_or_create_user(
+        email=body.email,
+        name=body.email.split('@')[0],
+        login_type="email"
+    )
+    message = "User registered and logged in successfully" if created else "Logged in successfully"
     
    
-    await log_user_login(user["id"], user["email"], user.get("login_type", "email"))
+    background_tasks.add_task(log_user_login, user["id"], user["email"], user.get("login_type", "email"))
 
     
-    access_token = create_access_token(data={
-        "sub": user["id"],
-        "mongo_id": user.get("mongo_id"),
-        "name": user.get("name"),
-        "email": user["email"],
-        "role": user.get("role", "user")
-    })
-
-    
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "message": message,
-        "user": {
-            "id": user["id"],
-            "mongo_id": user.get("mongo_id"),
-            "name": user.get("name"),
-            "email": user["email"],
-            "profile_pic": user.get("profile_pic"),
-            "login_type": user.get("login_type", "email"),
-            "role": user.get("role", "user"),
-            "created_at": user.get("created_at")
-        }
-    }
+    return ORJSONResponse(content=build_login_response(user, message))
 
 # =======================
 # Google Auth
 # =======================
 
 @router.post("/google")
-async def google_auth(body: GoogleAuthRequest):
+async def google_auth(body: GoogleAuthRequest, background_tasks: BackgroundTasks):
     """Google Login: Accepts user details, creates/updates user, returns JWT."""
     
     
-    user = await find_user_by_email(body.email)
-    
-    message = ""
-    if not user:
-       
-        user = await create_google_user(
-            name=body.name,
-            email=body.email,
-            profile_pic=body.profile_pic
-        )
-        message = "Google user registered and logged in successfully"
-    else:
-         
-        message = "Logged in with Google successfully"
-        
-   
-    await log_user_login(user["id"], user["email"], "google")
+    user, created = await get_or_create_user(
+        email=body.email,
+        name=body.name,
+        profile_pic=body.profile_pic,
+        login_type="google"
+    )
+    message = "Google user registered and logged in successfully" if created else "Logged in with Google successfully"
 
-    
-    access_token = create_access_token(data={
-        "sub": user["id"],
-        "mongo_id": user.get("mongo_id"),
-        "name": user.get("name"),
-        "email": user["email"],
-        "role": user.get("role", "user")
-    })
+    background_tasks.add_task(log_user_login, user["id"], user["email"], "google")
 
     
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "message": message,
-        "user": {
-            "id": user["id"],
-            "mongo_id": user.get("mongo_id"),
-            "name": user.get("name"),
-            "email": user["email"],
-            "profile_pic": user.get("profile_pic"),
-            "login_type": user.get("login_type", "google"),
-            "role": user.get("role", "user"),
-            "created_at": user.get("created_at")
-        }
-    }
+    return ORJSONResponse(content=build_login_response(user, message, default_login_type="google"))
 
 # =======================
 # Get User Info
@@ -313,7 +276,7 @@ async def get_me(user: dict = Depends(get_current_user)):
         "created_at": user.get("created_at"),
         "email_verified": user.get("email_verified", False)
     }
-    return user_response
+    return ORJSONResponse(content=user_response)
 
 @router.get("/login-history")
 async def get_login_history(user: dict = Depends(get_current_user)):
@@ -324,7 +287,6 @@ async def get_login_history(user: dict = Depends(get_current_user)):
 @user_router.get("/user/{user_id}")
 async def get_user_route(user_id: str):
     """Get user information by either UUID or MongoDB ID."""
-    from services.auth_service import find_user_by_mongo_id, find_user_by_id
     
     
     user = await find_user_by_mongo_id(user_id)
@@ -336,7 +298,7 @@ async def get_user_route(user_id: str):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {
+    return ORJSONResponse(content={
         "id": user.get("id"),
         "mongo_id": user.get("mongo_id"),
         "name": user.get("name"),
@@ -346,4 +308,4 @@ async def get_user_route(user_id: str):
         "role": user.get("role", "user"),
         "created_at": user.get("created_at"),
         "email_verified": user.get("email_verified", False)
-    }
+    })
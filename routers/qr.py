@@ -1,17 +1,30 @@
+import asyncio
+import binascii
+import aiofiles
 import os
+import stat
 import uuid
-import json
 import base64
+from functools import partial
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query, Request, Depends, Header
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile, File, Form, Query, Request, Depends, Header
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel, HttpUrl
-from qr_service import QRCodeService
-from services.qr_history_service import log_qr_generation, get_user_qr_history
+from bson.objectid import ObjectId
+from qr_service import QRCodeService, render_qr_code
+from services.qr_history_service import (
+    HISTORY_PAGE_SIZE,
+    delete_qr_history_item,
+    get_qr_history_item_public,
+    get_user_qr_history_json,
+    log_qr_generation,
+)
 from services.admin_service import AdminService
 from services.ads_service import AdsService
 from routers.auth import get_current_user, get_current_user_optional
 from routers.admin import get_current_admin
+from config import config
+from utils.validation import ALLOWED_IMAGE_EXTENSIONS, IMAGE_SIGNATURE_SIZE, VALID_PLACEMENTS, allowed_file, is_image_data, upload_filename
 
 router = APIRouter(tags=["QR & Ads"])
 
@@ -21,23 +34,75 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
 ADS_DATA_FILE = os.path.join(BASE_DIR, "ads_data.json")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
-VALID_PLACEMENTS = {
-    "top-wide",
-    "vertical-right",
-    "left-1",
-    "left-2",
-    "bottom-wide-1",
-    "bottom-wide-2",
-    "mobile-bottom-1",
-    "mobile-bottom-2",
-}
-
 qr_service = QRCodeService()
 
+QR_IMAGE_CACHE_CONTROL = "public, max-age=86400, immutable"
+# Upload names are a fresh random token plus extension (upload_filename), so a given URL never changes content
+UPLOAD_CACHE_CONTROL = "public, max-age=86400, immutable"
+
+UPLOAD_CHUNK_SIZE = 1 << 16
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+
+
+async def render_qr(request: Request, **options) -> Optional[bytes]:
+    """
+    Render a QR PNG in the app's process pool (app.state.qr_pool).
+
+    QR matrix building is pure Python and holds the GIL, so worker processes
+    give real parallelism. The image cache stays in this process: hits are
+    answered directly and fresh renders are added to it.
+    """
+    img_bytes = qr_service.get_cached_qr_code(**options)
+    if img_bytes is None:
+        loop = asyncio.get_running_loop()
+        img_bytes = await loop.run_in_executor(request.app.state.qr_pool, partial(render_qr_code, **options))
+        if img_bytes:
+            qr_service.cache_qr_code(img_bytes, **options)
+    return img_bytes
+
+
+async def save_upload(image: UploadFile, image_path: str, error_detail: str) -> None:
+    """
+    Stream an uploaded image to disk in 64 KB chunks without blocking the loop.
+
+    The first chunk is checked for an image signature before anything is written.
+    Data goes to a .part file that is renamed into place once complete; uploads
+    over MAX_UPLOAD_SIZE are discarded with a 413.
+    """
+    chunk = await image.read(UPLOAD_CHUNK_SIZE)
+    if not is_image_data(chunk[:IMAGE_SIGNATURE_SIZE]):
+        raise HTTPException(status_code=400, detail=error_detail)
+
+    tmp_path = image_path + ".part"
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as buffer:
+            while chunk:
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Uploads are limited to {MAX_UPLOAD_SIZE // (1024 * 1024)} MB"
+                    )
+                await buffer.write(chunk)
+                chunk = await image.read(UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        remove_upload(tmp_path)
+        raise
+    os.replace(tmp_path, image_path)
+
+
+def remove_upload(image_path: Optional[str]) -> None:
+    """Delete an ad image; a file that is already gone is not an error."""
+    if not image_path:
+        return
+    try:
+        os.remove(image_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove {image_path}: {e}")
 
-def allowed_file(filename: str) -> bool:
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
 
 def serialize_ad(ad: dict) -> dict:
     return {
@@ -49,6 +114,18 @@ def serialize_ad(ad: dict) -> dict:
     }
 
 
+def api_base_url(request: Request) -> str:
+    """External base URL of the API, without a trailing slash."""
+    return config.PUBLIC_BASE_URL or str(request.base_url).rstrip("/")
+
+
+def public_upload_url(request: Request, filename: str) -> str:
+    """Public URL of an uploaded ad image; the CDN/nginx base when configured."""
+    if config.PUBLIC_UPLOADS_BASE:
+        return f"{config.PUBLIC_UPLOADS_BASE}/{filename}"
+    return f"{api_base_url(request)}/uploads/{filename}"
+
+
 class QRCustomization(BaseModel):
     fill_color: Optional[str] = "black"
     back_color: Optional[str] = "white"
@@ -61,6 +138,10 @@ class QRRequest(BaseModel):
     url: str
     customization: Optional[QRCustomization] = None
 
+def customization_options(customization: Optional[QRCustomization]) -> dict:
+    """Render options from a request's customization block; {} leaves every default."""
+    return customization.model_dump() if customization else {}
+
 class AdUpdate(BaseModel):
     placement: Optional[str] = None
     redirectUrl: Optional[str] = None
@@ -69,13 +150,28 @@ class AdUpdate(BaseModel):
 class AdStatusUpdate(BaseModel):
     isActive: bool
 
+class AdsBulkDelete(BaseModel):
+    ids: List[int]
+
 
 @router.get("/uploads/{filename}")
 async def serve_uploaded_file(filename: str):
+    if config.UPLOADS_ACCEL_PREFIX:
+        # nginx serves the file itself via its internal location, keeping this Cache-Control
+        return Response(headers={
+            "X-Accel-Redirect": f"{config.UPLOADS_ACCEL_PREFIX.rstrip('/')}/{filename}",
+            "Cache-Control": UPLOAD_CACHE_CONTROL,
+        })
+
     file_path = os.path.join(UPLOAD_FOLDER, filename)
-    if not os.path.exists(file_path):
+    try:
+        stat_result = os.stat(file_path)
+    except OSError:
+        stat_result = None
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+    # Hand over the stat so FileResponse doesn't repeat it
+    return FileResponse(file_path, stat_result=stat_result, headers={"Cache-Control": UPLOAD_CACHE_CONTROL})
 
 @router.post("/ads")
 async def create_ad(
@@ -92,15 +188,12 @@ async def create_ad(
     if not allowed_file(image.filename):
         raise HTTPException(status_code=400, detail=f"Invalid image type. Allowed: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}")
 
-    filename = f"{uuid.uuid4().hex}_{image.filename}"
+    filename = upload_filename(image.filename)
     image_path = os.path.join(UPLOAD_FOLDER, filename)
     
-    with open(image_path, "wb") as buffer:
-        content = await image.read()
-        buffer.write(content)
+    await save_upload(image, image_path, f"Invalid image type. Allowed: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}")
     
-    base_url = str(request.base_url).rstrip("/")
-    image_url = f"{base_url}/uploads/{filename}"
+    image_url = public_upload_url(request, filename)
 
     ad = {
         "placement": placement,
@@ -152,22 +245,16 @@ async def update_ad(
         if not allowed_file(image.filename):
             raise HTTPException(status_code=400, detail="Invalid image type")
         
-        filename = f"{uuid.uuid4().hex}_{image.filename}"
+        filename = upload_filename(image.filename)
         image_path = os.path.join(UPLOAD_FOLDER, filename)
         
-        with open(image_path, "wb") as buffer:
-            content = await image.read()
-            buffer.write(content)
+        await save_upload(image, image_path, "Invalid image type")
             
         # Cleanup old image
-        old_path = ad.get("imagePath")
-        if old_path and os.path.exists(old_path):
-            try: os.remove(old_path)
-            except: pass
+        remove_upload(ad.get("imagePath"))
             
         update_data["imagePath"] = image_path
-        base_url = str(request.base_url).rstrip("/")
-        update_data["imageUrl"] = f"{base_url}/uploads/{filename}"
+        update_data["imageUrl"] = public_upload_url(request, filename)
 
     updated_ad = await AdsService.update_ad(ad_id, update_data)
     return serialize_ad(updated_ad)
@@ -178,14 +265,18 @@ async def delete_ad(ad_id: int, admin: dict = Depends(get_current_admin)):
     if not ad:
         raise HTTPException(status_code=404, detail="Ad not found")
 
-    image_path = ad.get("imagePath")
-    if image_path and os.path.exists(image_path):
-        try: os.remove(image_path)
-        except: pass
+    remove_upload(ad.get("imagePath"))
         
     await AdsService.delete_ad(ad_id)
     return {"deleted": ad_id}
 
+@router.post("/ads/bulk_delete")
+async def bulk_delete_ads(body: AdsBulkDelete, admin: dict = Depends(get_current_admin)):
+    deleted = await AdsService.bulk_delete_ads(body.ids)
+    # Image unlinks are independent; issue them concurrently from the threadpool
+    await asyncio.gather(*(asyncio.to_thread(remove_upload, ad.get("imagePath")) for ad in deleted))
+    return {"deleted": [ad["id"] for ad in deleted]}
+
 @router.post("/ads/{ad_id}/status")
 async def set_ad_status(ad_id: int, body: AdStatusUpdate, admin: dict = Depends(get_current_admin)):
     """Explicitly enable or disable a specific advertisement."""
@@ -216,35 +307,19 @@ async def toggle_ad_status(ad_id: int, admin: dict = Depends(get_current_admin))
 
 
 @router.post("/generate")
-async def generate_qr_code(request: Request, body: QRRequest, user: Optional[dict] = Depends(get_current_user_optional)):
+async def generate_qr_code(request: Request, body: QRRequest, background_tasks: BackgroundTasks, user: Optional[dict] = Depends(get_current_user_optional)):
     # Extract customization parameters
-    customization_dict = {}
-    if body.customization:
-        customization_dict = {
-            "fill_color": body.customization.fill_color,
-            "back_color": body.customization.back_color,
-            "pattern": body.customization.pattern,
-            "error_correction": body.customization.error_correction,
-            "logo": body.customization.logo,
-            "logo_size": body.customization.logo_size
-        }
+    customization_dict = customization_options(body.customization)
     
     # Generate QR code with customization
-    qr_code_base64 = qr_service.generate_qr_code_base64(
-        url=body.url,
-        fill_color=customization_dict.get("fill_color", "black"),
-        back_color=customization_dict.get("back_color", "white"),
-        pattern=customization_dict.get("pattern", "square"),
-        error_correction=customization_dict.get("error_correction", "L"),
-        logo=customization_dict.get("logo"),
-        logo_size=customization_dict.get("logo_size", 0.3)
-    )
+    qr_code_bytes = await render_qr(request, url=body.url, **customization_dict)
     
-    if qr_code_base64:
+    if qr_code_bytes:
+        qr_code_base64 = binascii.b2a_base64(qr_code_bytes, newline=False).decode('ascii')
         if user:
             user_id = user["id"]
-            base_url = str(request.base_url).rstrip("/")
-            await log_qr_generation(body.url, user_id, customization_dict if body.customization else None, base_url)
+            base_url = api_base_url(request)
+            background_tasks.add_task(log_qr_generation, body.url, user_id, customization_dict if body.customization else None, base_url, qr_code_bytes)
             
         return {
             "success": True,
@@ -257,44 +332,27 @@ async def generate_qr_code(request: Request, body: QRRequest, user: Optional[dic
     raise HTTPException(status_code=500, detail="Failed to generate QR code")
 
 @router.post("/generate/image")
-async def generate_qr_code_image(request: Request, body: QRRequest, user: Optional[dict] = Depends(get_current_user_optional)):
+async def generate_qr_code_image(request: Request, body: QRRequest, background_tasks: BackgroundTasks, user: Optional[dict] = Depends(get_current_user_optional)):
     # Extract customization parameters
-    customization_dict = {}
-    if body.customization:
-        customization_dict = {
-            "fill_color": body.customization.fill_color,
-            "back_color": body.customization.back_color,
-            "pattern": body.customization.pattern,
-            "error_correction": body.customization.error_correction,
-            "logo": body.customization.logo,
-            "logo_size": body.customization.logo_size
-        }
+    customization_dict = customization_options(body.customization)
     
     # Generate QR code with customization
-    qr_code_bytes = qr_service.generate_qr_code(
-        url=body.url,
-        fill_color=customization_dict.get("fill_color", "black"),
-        back_color=customization_dict.get("back_color", "white"),
-        pattern=customization_dict.get("pattern", "square"),
-        error_correction=customization_dict.get("error_correction", "L"),
-        logo=customization_dict.get("logo"),
-        logo_size=customization_dict.get("logo_size", 0.3)
-    )
+    qr_code_bytes = await render_qr(request, url=body.url, **customization_dict)
     
     if qr_code_bytes:
         if user:
             user_id = user["id"]
-            base_url = str(request.base_url).rstrip("/")
-            await log_qr_generation(body.url, user_id, customization_dict if body.customization else None, base_url)
+            base_url = api_base_url(request)
+            background_tasks.add_task(log_qr_generation, body.url, user_id, customization_dict if body.customization else None, base_url, qr_code_bytes)
             
-        from io import BytesIO
-        return StreamingResponse(BytesIO(qr_code_bytes), media_type="image/png")
+        return Response(content=qr_code_bytes, media_type="image/png")
     raise HTTPException(status_code=500, detail="Failed to generate QR code")
 
 @router.get("/generate/{url:path}")
 async def generate_qr_code_get(
     request: Request, 
     url: str, 
+    background_tasks: BackgroundTasks,
     fill_color: Optional[str] = Query("black"),
     back_color: Optional[str] = Query("white"),
     pattern: Optional[str] = Query("square"),
@@ -313,7 +371,8 @@ async def generate_qr_code_get(
     }
     
     # Generate QR code with customization
-    qr_code_bytes = qr_service.generate_qr_code(
+    qr_code_bytes = await render_qr(
+        request,
         url=url,
         fill_color=fill_color,
         back_color=back_color,
@@ -324,80 +383,65 @@ async def generate_qr_code_get(
     if qr_code_bytes:
         if user:
             user_id = user["id"]
-            base_url = str(request.base_url).rstrip("/")
-            await log_qr_generation(url, user_id, customization_dict, base_url)
-            
-        from io import BytesIO
-        return StreamingResponse(BytesIO(qr_code_bytes), media_type="image/png")
+            base_url = api_base_url(request)
+            background_tasks.add_task(log_qr_generation, url, user_id, customization_dict, base_url, qr_code_bytes)
+            headers = {"Cache-Control": "private, no-store", "Vary": "Authorization"}
+        else:
+            # Same URL + options always render the same image; only anonymous
+            # hits may be served from caches, so signed-in ones still get logged.
+            # Vary keeps caches from answering a signed-in request with this copy.
+            headers = {"Cache-Control": QR_IMAGE_CACHE_CONTROL, "Vary": "Authorization"}
+
+        return Response(content=qr_code_bytes, media_type="image/png", headers=headers)
     raise HTTPException(status_code=500, detail="Failed to generate QR code")
 
 @router.post("/download")
-async def download_qr_code(body: QRRequest, user: dict = Depends(get_current_user)):
+async def download_qr_code(request: Request, body: QRRequest, user: dict = Depends(get_current_user)):
     """Only authenticated users can download the QR code image."""
     # Extract customization parameters
-    customization_dict = {}
-    if body.customization:
-        customization_dict = {
-            "fill_color": body.customization.fill_color,
-            "back_color": body.customization.back_color,
-            "pattern": body.customization.pattern,
-            "error_correction": body.customization.error_correction,
-            "logo": body.customization.logo,
-            "logo_size": body.customization.logo_size
-        }
+    customization_dict = customization_options(body.customization)
     
     # Generate QR code with customization
-    qr_code_bytes = qr_service.generate_qr_code(
-        url=body.url,
-        fill_color=customization_dict.get("fill_color", "black"),
-        back_color=customization_dict.get("back_color", "white"),
-        pattern=customization_dict.get("pattern", "square"),
-        error_correction=customization_dict.get("error_correction", "L"),
-        logo=customization_dict.get("logo"),
-        logo_size=customization_dict.get("logo_size", 0.3)
-    )
+    qr_code_bytes = await render_qr(request, url=body.url, **customization_dict)
     
     if qr_code_bytes:
-        from io import BytesIO
         filename = f"qr_{uuid.uuid4().hex[:8]}.png"
         headers = {
             'Content-Disposition': f'attachment; filename="{filename}"'
         }
-        return StreamingResponse(BytesIO(qr_code_bytes), media_type="image/png", headers=headers)
+        return Response(content=qr_code_bytes, media_type="image/png", headers=headers)
     raise HTTPException(status_code=500, detail="Failed to generate QR code for download")
 
 @router.get("/history")
-async def get_history(request: Request, user: dict = Depends(get_current_user)):
-    history = await get_user_qr_history(user["id"])
-    base_url = str(request.base_url).rstrip("/")
-    for entry in history:
-        # Provide the actual base64 image data in his preferred field name
-        if "qr_code" in entry:
-            entry["qr_image"] = entry["qr_code"]
-        
-        # Also provide the direct view URL
-        entry["qr_image_url"] = f"{base_url}/history/{entry['_id']}/image"
-    return history
+async def get_history(
+    request: Request,
+    before_id: Optional[str] = Query(None),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=100),
+    user: dict = Depends(get_current_user)
+):
+    if before_id and not ObjectId.is_valid(before_id):
+        raise HTTPException(status_code=400, detail="Invalid before_id")
+    # Serialized once by orjson in the service (and cached as bytes); sent as is
+    body = await get_user_qr_history_json(user["id"], api_base_url(request), before_id, limit)
+    return Response(content=body, media_type="application/json")
 
 @router.get("/history/{history_id}/image")
 async def get_history_image(history_id: str):
-    from services.qr_history_service import get_qr_history_item_public
-    from io import BytesIO
-    
     item = await get_qr_history_item_public(history_id)
+    if item and "qr_png" in item:
+        return Response(content=bytes(item["qr_png"]), media_type="image/png")
+    # Entries written before raw PNG storage carry a base64 qr_code instead
     if not item or "qr_code" not in item:
         raise HTTPException(status_code=404, detail="QR history item or image not found")
     
     try:
         qr_code_bytes = base64.b64decode(item["qr_code"])
-        return StreamingResponse(BytesIO(qr_code_bytes), media_type="image/png")
+        return Response(content=qr_code_bytes, media_type="image/png")
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to decode QR image")
 
 @router.delete("/history/{history_id}")
 async def delete_history(history_id: str, user: dict = Depends(get_current_user)):
-    from services.qr_history_service import delete_qr_history_item
-    
     success = await delete_qr_history_item(history_id, user["id"])
     if not success:
         raise HTTPException(status_code=404, detail="History item not found or could not be deleted")
@@ -1,7 +1,34 @@
+import asyncio
+import time
 from database import db
-from typing import Dict, Any
+from services.auth_service import find_user_by_email, create_user
+from typing import Dict, Any, Optional
 
 class AdminService:
+    # Admin account mongo ids by email; the account is created once and never changes
+    _admin_mongo_ids: Dict[str, str] = {}
+    # Global ads switch, consulted on every GET /ads; other workers see changes within the TTL
+    ADS_ENABLED_TTL = 15.0
+    _ads_enabled: Optional[bool] = None
+    _ads_enabled_expires: float = 0.0
+
+    @staticmethod
+    async def get_admin_mongo_id(email: str) -> str:
+        """Find (or create on first login) the admin user and return its mongo id."""
+        mongo_id = AdminService._admin_mongo_ids.get(email)
+        if mongo_id:
+            return mongo_id
+        admin_user = await find_user_by_email(email)
+        if not admin_user:
+            admin_user = await create_user(
+                name="Admin",
+                email=email,
+                role="admin"
+            )
+        mongo_id = admin_user.get("mongo_id")
+        AdminService._admin_mongo_ids[email] = mongo_id
+        return mongo_id
+
     @staticmethod
     async def get_settings() -> Dict[str, Any]:
         settings = await db.db.settings.find_one({"type": "global"})
@@ -22,18 +49,30 @@ class AdminService:
             {"$set": {"ads_enabled": enabled}},
             upsert=True
         )
+        AdminService._ads_enabled = enabled
+        AdminService._ads_enabled_expires = time.monotonic() + AdminService.ADS_ENABLED_TTL
         return {"ads_enabled": enabled}
 
     @staticmethod
     async def is_ads_enabled() -> bool:
+        now = time.monotonic()
+        if now < AdminService._ads_enabled_expires:
+            return AdminService._ads_enabled
         settings = await AdminService.get_settings()
-        return settings.get("ads_enabled", True)
+        enabled = settings.get("ads_enabled", True)
+        AdminService._ads_enabled = enabled
+        AdminService._ads_enabled_expires = now + AdminService.ADS_ENABLED_TTL
+        return enabled
 
     @staticmethod
     async def get_dashboard_stats() -> Dict[str, Any]:
-        total_qr_codes = await db.db.qr_history.count_documents({})
-        active_users = await db.db.users.count_documents({})
-        activated_ads = await db.db.ads.count_documents({"isActive": True})
+        # Independent counts: run them concurrently over the connection pool.
+        # Whole-collection totals come from collection metadata instead of a scan.
+        total_qr_codes, active_users, activated_ads = await asyncio.gather(
+            db.db.qr_history.estimated_document_count(),
+            db.db.users.estimated_document_count(),
+            db.db.ads.count_documents({"isActive": True})
+        )
         
         return {
             "total_qr_codes": total_qr_codes,
@@ -1,27 +1,55 @@
 from database import db
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 class AdsService:
+    LIST_LIMIT = 100
+    LIST_PROJECTION = {"_id": 0, "id": 1, "placement": 1, "imageUrl": 1, "redirectUrl": 1, "isActive": 1}
+
+    @staticmethod
+    async def next_ad_id() -> int:
+        """Allocate the next ad id from the atomic counters document."""
+        counter = await db.db.counters.find_one_and_update(
+            {"_id": "ads"},
+            {"$inc": {"seq": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if counter is None:
+            # First allocation: seed the counter from the highest existing id
+            last_ad = await db.db.ads.find_one(sort=[("id", -1)], projection={"id": 1})
+            try:
+                await db.db.counters.insert_one({"_id": "ads", "seq": last_ad.get("id", 0) if last_ad else 0})
+            except DuplicateKeyError:
+                pass  # Another worker seeded it first
+            counter = await db.db.counters.find_one_and_update(
+                {"_id": "ads"},
+                {"$inc": {"seq": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+        return counter["seq"]
+
     @staticmethod
     async def get_all_ads(placement: Optional[str] = None, only_active: bool = False) -> List[Dict[str, Any]]:
         query = {}
         if placement:
             query["placement"] = placement
+        if only_active:
+            # Ads saved before isActive existed count as active, as in serialize_ad
+            query["isActive"] = {"$ne": False}
 
-        cursor = db.db.ads.find(query)
-        ads = await cursor.to_list(length=100)
+        # Only the fields serialize_ad sends to clients, capped server-side
+        cursor = db.db.ads.find(query, AdsService.LIST_PROJECTION).limit(AdsService.LIST_LIMIT)
+        ads = await cursor.to_list(length=AdsService.LIST_LIMIT)
         
         return ads
 
     @staticmethod
     async def create_ad(ad_data: Dict[str, Any]) -> Dict[str, Any]:
         
-        last_ad = await db.db.ads.find_one(sort=[("id", -1)])
-        new_id = (last_ad["id"] + 1) if last_ad and "id" in last_ad else 1
-        
-        ad_data["id"] = new_id
-        ad_data["created_at"] = datetime.utcnow()
+        ad_data["id"] = await AdsService.next_ad_id()
+        ad_data["created_at"] = datetime.now(timezone.utc)
         
         result = await db.db.ads.insert_one(ad_data)
         ad_data["_id"] = str(result.inserted_id)
@@ -29,10 +57,7 @@ class AdsService:
 
     @staticmethod
     async def get_ad_by_id(ad_id: int) -> Optional[Dict[str, Any]]:
-        ad = await db.db.ads.find_one({"id": ad_id})
-        if ad:
-            ad["_id"] = str(ad["_id"])
-        return ad
+        return await db.db.ads.find_one({"id": ad_id}, {"_id": 0})
 
     @staticmethod
     async def update_ad(ad_id: int, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -44,6 +69,15 @@ class AdsService:
         result = await db.db.ads.delete_one({"id": ad_id})
         return result.deleted_count > 0
 
+    @staticmethod
+    async def bulk_delete_ads(ad_ids: List[int]) -> List[Dict[str, Any]]:
+        """Delete several ads in two round-trips; returns the deleted ads' ids and image paths."""
+        cursor = db.db.ads.find({"id": {"$in": ad_ids}}, {"_id": 0, "id": 1, "imagePath": 1})
+        ads = await cursor.to_list(length=None)
+        if ads:
+            await db.db.ads.delete_many({"id": {"$in": [ad["id"] for ad in ads]}})
+        return ads
+
     @staticmethod
     async def toggle_ad_status(ad_id: int) -> Optional[Dict[str, Any]]:
         ad = await AdsService.get_ad_by_id(ad_id)
@@ -1,9 +1,15 @@
 import uuid
-import random
-import string
-from typing import Optional, Dict, List
-from datetime import datetime
+import secrets
+from typing import Optional, Dict, List, Tuple
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+from cachetools import TTLCache
+from pymongo import ReturnDocument
 from database import db
+from services.log_writer import user_log_writer
+
+# Recently fetched users by id; every authenticated request looks its user up
+_users_by_id = TTLCache(maxsize=8192, ttl=30)
 
 async def find_user_by_email(email: str) -> Optional[Dict]:
     user = await db.db.users.find_one({"email": email})
@@ -13,14 +19,17 @@ async def find_user_by_email(email: str) -> Optional[Dict]:
     return user
 
 async def find_user_by_id(user_id: str) -> Optional[Dict]:
+    user = _users_by_id.get(user_id)
+    if user is not None:
+        return dict(user)
     user = await db.db.users.find_one({"id": user_id})
     if user:
         user["mongo_id"] = str(user["_id"])
         user["_id"] = str(user["_id"])
+        _users_by_id[user_id] = dict(user)
     return user
 
 async def find_user_by_mongo_id(mongo_id: str) -> Optional[Dict]:
-    from bson.objectid import ObjectId
     try:
         user = await db.db.users.find_one({"_id": ObjectId(mongo_id)})
         if user:
@@ -48,17 +57,43 @@ async def create_user(name: str, email: str, profile_pic: Optional[str] = None,
     user["_id"] = str(user["_id"])
     return user
 
+async def get_or_create_user(email: str, name: str, profile_pic: Optional[str] = None, login_type: str = "email", role: str = "user") -> Tuple[Dict, bool]:
+    """
+    Fetch the user for an email, creating it first if needed, in one round-trip.
+    Returns the user and whether it was just created.
+    """
+    user_id = str(uuid.uuid4())
+    user = await db.db.users.find_one_and_update(
+        {"email": email},
+        {"$setOnInsert": {
+            "id": user_id,
+            "name": name,
+            "email": email,
+            "email_verified": True,
+            "profile_pic": profile_pic,
+            "login_type": login_type,
+            "role": role,
+            "created_at": datetime.utcnow().isoformat()
+        }},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    user["mongo_id"] = str(user["_id"])
+    user["_id"] = str(user["_id"])
+    return user, user["id"] == user_id
+
 async def create_google_user(name: str, email: str, profile_pic: Optional[str] = None) -> Dict:
     """Create a new user via Google OAuth."""
     return await create_user(name, email, profile_pic, "google")
 
 def generate_otp(length: int = 6) -> str:
-    return "".join(random.choices(string.digits, k=length))
+    # One CSPRNG draw, zero-padded; unbiased unlike per-digit byte % 10
+    return f"{secrets.randbelow(10 ** length):0{length}d}"
 
 async def save_otp(email: str, otp: str):
     await db.db.otps.update_one(
         {"email": email},
-        {"$set": {"otp": otp, "created_at": datetime.utcnow()}},
+        {"$set": {"otp": otp, "created_at": datetime.now(timezone.utc)}},
         upsert=True
     )
 
@@ -76,11 +111,10 @@ async def log_user_login(user_id: str, email: str, login_type: str):
         "user_id": user_id,
         "email": email,
         "login_type": login_type,
-        "timestamp": datetime.utcnow(),
+        "timestamp": datetime.now(timezone.utc),
         "type": "user_login"
     }
-    await db.db.user_logs.insert_one(log_entry)
-    print(f"Logged user login: {email} (ID: {user_id})")
+    user_log_writer.enqueue(log_entry)
 
 async def get_user_login_history(user_id: str):
     """Retrieve login history for a specific user."""
@@ -1,22 +1,65 @@
+import atexit
 import smtplib
 import os
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional
 
 
-def get_otp_email_template(otp: str, purpose: str = "verification") -> str:
-    """
-    Generate a professional HTML email template for OTP
-    """
-    if purpose == "reset":
-        title = "Password Reset Request"
-        message = "You requested to reset your password. Use the OTP below to proceed:"
-    else:
-        title = "Email Verification"
-        message = "Thank you for registering! Use the OTP below to verify your email:"
-    
-    return f"""
+# One authenticated SMTP session shared by all sends; the TLS handshake and
+# AUTH cost far more than a message, so they are paid once, not per email
+_smtp_lock = threading.Lock()
+_smtp_conn: Optional[smtplib.SMTP] = None
+
+# Socket timeout (seconds) for connect and every command on the session. Sends
+# queue behind _smtp_lock, so a stalled server must fail fast, not block them all.
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))
+
+
+def _smtp_connection(smtp_server: str, smtp_port: int, smtp_username: str, smtp_password: str) -> smtplib.SMTP:
+    """Return the live SMTP session, reconnecting if the server dropped it. Call with _smtp_lock held."""
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            if _smtp_conn.noop()[0] == 250:
+                return _smtp_conn
+        except (smtplib.SMTPException, OSError):
+            pass
+        _close_smtp_connection()
+
+    print(f"📧 Connecting to {smtp_server}:{smtp_port}...")
+    server = smtplib.SMTP(smtp_server, smtp_port, timeout=SMTP_TIMEOUT)
+    try:
+        server.starttls()  # Secure the connection
+        server.login(smtp_username, smtp_password)
+    except Exception:
+        server.close()
+        raise
+    _smtp_conn = server
+    return server
+
+
+def _close_smtp_connection():
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            _smtp_conn.quit()
+        except (smtplib.SMTPException, OSError):
+            _smtp_conn.close()
+        _smtp_conn = None
+
+
+def _close_smtp_on_exit():
+    with _smtp_lock:
+        _close_smtp_connection()
+
+
+atexit.register(_close_smtp_on_exit)
+
+
+# Rendered with str.format; literal CSS braces are doubled
+OTP_EMAIL_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -100,6 +143,20 @@ def get_otp_email_template(otp: str, purpose: str = "verification") -> str:
     """
 
 
+def get_otp_email_template(otp: str, purpose: str = "verification") -> str:
+    """
+    Generate a professional HTML email template for OTP
+    """
+    if purpose == "reset":
+        title = "Password Reset Request"
+        message = "You requested to reset your password. Use the OTP below to proceed:"
+    else:
+        title = "Email Verification"
+        message = "Thank you for registering! Use the OTP below to verify your email:"
+    
+    return OTP_EMAIL_TEMPLATE.format(title=title, message=message, otp=otp)
+
+
 def send_email(to_email: str, subject: str, body: str, is_html: bool = False) -> bool:
     """
     Send email using SMTP (Gmail)
@@ -139,12 +196,19 @@ def send_email(to_email: str, subject: str, body: str, is_html: bool = False) ->
         else:
             msg.attach(MIMEText(body, 'plain'))
         
-        # Connect to SMTP server and send email
-        print(f"📧 Connecting to {smtp_server}:{smtp_port}...")
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()  # Secure the connection
-            server.login(smtp_username, smtp_password)
-            server.send_message(msg)
+        # Send over the shared session; one retry covers a connection that died after NOOP
+        with _smtp_lock:
+            try:
+                _smtp_connection(smtp_server, smtp_port, smtp_username, smtp_password).send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                _close_smtp_connection()
+                _smtp_connection(smtp_server, smtp_port, smtp_username, smtp_password).send_message(msg)
+            except smtplib.SMTPException:
+                raise  # A protocol-level refusal; the session itself is fine
+            except OSError:
+                # Timed out mid-command; the session state is unknown, so start fresh next time
+                _close_smtp_connection()
+                raise
         
         print(f"✅ Email sent successfully to {to_email}")
         return True
@@ -0,0 +1,98 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+from pymongo.write_concern import WriteConcern
+from database import db
+
+
+class BatchedLogWriter:
+    """
+    Buffers log documents for one collection and writes them in insert_many bursts.
+
+    The queue and its drain task are created lazily on the event loop of the first
+    enqueue. When the queue is full, new entries are dropped rather than blocking.
+    A batch is written once it is full or max_wait seconds after its first entry;
+    on_written, if set, is then awaited with the batch.
+    """
+
+    def __init__(self, collection: str, maxsize: int = 10_000, batch_size: int = 500, max_wait: float = 0.05,
+                 write_concern: Optional[WriteConcern] = None,
+                 on_written: Optional[Callable[[List[Dict]], Awaitable]] = None):
+        self.collection = collection
+        self.write_concern = write_concern
+        self.on_written = on_written
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, document: Dict):
+        """Queue a document for writing; must be called from the event loop."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+        try:
+            self._queue.put_nowait(document)
+        except asyncio.QueueFull:
+            print(f"Dropped {self.collection} log entry: write queue is full")
+
+    def _take_batch(self, first: Dict) -> List[Dict]:
+        batch = [first]
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _write(self, batch: List[Dict]):
+        try:
+            collection = db.db[self.collection]
+            if self.write_concern is not None:
+                collection = collection.with_options(write_concern=self.write_concern)
+            await collection.insert_many(batch, ordered=False)
+        except Exception as e:
+            print(f"Failed to write {len(batch)} {self.collection} log entries: {e}")
+            return
+        if self.on_written is not None:
+            try:
+                await self.on_written(batch)
+            except Exception as e:
+                print(f"{self.collection} post-write hook failed: {e}")
+
+    async def _fill_batch(self, first: Dict) -> List[Dict]:
+        """Take what is queued, then linger up to max_wait for more entries."""
+        batch = self._take_batch(first)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _drain(self):
+        while True:
+            batch = await self._fill_batch(await self._queue.get())
+            await self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def flush(self):
+        """Wait until everything queued has been written, then stop the drain task."""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        self._queue = self._task = None
+
+
+# Generation history is best-effort: unacknowledged writes skip the server round-trip
+qr_history_writer = BatchedLogWriter("qr_history", write_concern=WriteConcern(w=0))
+qr_image_writer = BatchedLogWriter("qr_images", write_concern=WriteConcern(w=0))
+user_log_writer = BatchedLogWriter("user_logs")
+
+
+async def flush_log_writers():
+    await asyncio.gather(qr_history_writer.flush(), qr_image_writer.flush(), user_log_writer.flush())
@@ -1,8 +1,53 @@
-from datetime import datetime
+import orjson
+import redis.asyncio as aioredis
+from datetime import datetime, timezone
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from redis.exceptions import RedisError
+from config import config
 from database import db
-from typing import Optional
+from services.log_writer import qr_history_writer, qr_image_writer
+from typing import List, Optional
 
-async def log_qr_generation(url: str, user_id: Optional[str] = None, customization: Optional[dict] = None, base_url: Optional[str] = None):
+# Per-user history pages (only when REDIS_URL is configured). Each user's pages
+# share one hash, so a single DEL invalidates them all.
+history_cache = aioredis.Redis.from_url(
+    config.REDIS_URL,
+    socket_timeout=config.REDIS_TIMEOUT,
+    socket_connect_timeout=config.REDIS_TIMEOUT,
+) if config.REDIS_URL else None
+
+def history_cache_key(user_id: str) -> str:
+    return f"qrh:{user_id}"
+
+async def invalidate_user_qr_history(user_id: Optional[str]):
+    if history_cache is None or not user_id:
+        return
+    try:
+        await history_cache.delete(history_cache_key(user_id))
+    except RedisError:
+        pass
+
+async def _invalidate_written_history(batch: List[dict]):
+    """Drop cached pages for every user in a batch once it has been written."""
+    if history_cache is None:
+        return
+    keys = {history_cache_key(entry["user_id"]) for entry in batch if entry.get("user_id")}
+    if not keys:
+        return
+    try:
+        await history_cache.delete(*keys)
+    except RedisError:
+        pass
+
+if history_cache is not None:
+    # Invalidate once the insert is applied, not at enqueue, so a page cached
+    # after the DEL includes the new entry. That needs acknowledged writes: with
+    # w=0 insert_many returns before the server has applied anything.
+    qr_history_writer.write_concern = None
+    qr_history_writer.on_written = _invalidate_written_history
+
+async def log_qr_generation(url: str, user_id: Optional[str] = None, customization: Optional[dict] = None, base_url: Optional[str] = None, qr_png: Optional[bytes] = None):
     """
     Log a QR code generation event to MongoDB with customization details.
     
@@ -11,15 +56,20 @@ async def log_qr_generation(url: str, user_id: Optional[str] = None, customizati
         user_id: User ID who generated the QR code
         customization: Dictionary containing customization options (colors, pattern, logo, etc.)
         base_url: Base URL for generating image URLs
+        qr_png: Rendered PNG, stored in qr_images under the same _id for the history image route
+    
+    Returns:
+        The pre-generated history id; the entry itself is written in the background
     """
-    from bson.objectid import ObjectId
     history_id = ObjectId()
+    # Hex form for the image URL and the return value, converted once
+    hex_id = history_id.binary.hex()
     
     log_entry = {
         "_id": history_id,
         "url": url,
         "user_id": user_id,
-        "timestamp": datetime.utcnow(),
+        "timestamp": datetime.now(timezone.utc),
         "type": "qr_generation"
     }
     
@@ -35,62 +85,147 @@ async def log_qr_generation(url: str, user_id: Optional[str] = None, customizati
         }
     
     if base_url:
-        log_entry["qr_image_url"] = f"{base_url}/history/{str(history_id)}/image"
+        log_entry["qr_image_url"] = f"{base_url}/history/{hex_id}/image"
         
-    await db.db.qr_history.insert_one(log_entry)
-    print(f"Logged QR generation: {url} (User: {user_id}, Customized: {bool(customization)})")
+    qr_history_writer.enqueue(log_entry)
+    # The image lives in its own collection so history documents stay small
+    if qr_png:
+        qr_image_writer.enqueue({"_id": history_id, "qr_png": Binary(qr_png)})
+    return hex_id
+
+HISTORY_PAGE_SIZE = 50
 
-async def get_user_qr_history(user_id: str):
+async def iter_user_qr_history(user_id: str, base_url: Optional[str] = None, before_id: Optional[str] = None,
+                               limit: int = HISTORY_PAGE_SIZE):
     """
-    Retrieve QR generation history for a specific user.
+    Stream QR generation history for a specific user, newest first.
+    Pages are keyset-based: pass the last _id of the previous page as before_id.
+    Entries are ordered by _id: ObjectIds are generated when the entry is logged,
+    so this is creation order to within a second, and it stays on the index.
+    The server stringifies _id and, given base_url, fills in each qr_image_url.
     """
-    cursor = db.db.qr_history.find({"user_id": user_id}).sort("timestamp", -1)
-    history = await cursor.to_list(length=100)
-    for entry in history:
-        entry["_id"] = str(entry["_id"])
-    return history
+    fields = {"_id": {"$toString": "$_id"}}
+    if base_url:
+        fields["qr_image_url"] = {"$concat": [f"{base_url}/history/", {"$toString": "$_id"}, "/image"]}
+    query = {"user_id": user_id}
+    if before_id:
+        query["_id"] = {"$lt": ObjectId(before_id)}
+    cursor = db.db.qr_history.aggregate([
+        {"$match": query},
+        {"$sort": {"_id": -1}},
+        {"$limit": limit},
+        # Entries logged before images moved to qr_images embed them; the list
+        # only links to the image route
+        {"$project": {"qr_png": 0, "qr_code": 0}},
+        {"$addFields": fields}
+    ], batchSize=limit)
+    async for item in cursor:
+        yield item
 
-async def get_qr_history_item(history_id: str, user_id: str):
+async def get_user_qr_history(user_id: str, base_url: Optional[str] = None, before_id: Optional[str] = None,
+                              limit: int = HISTORY_PAGE_SIZE):
     """
-    Retrieve a specific QR history item by ID and user_id.
+    Retrieve one page of QR generation history for a specific user as a list.
+    """
+    return [item async for item in iter_user_qr_history(user_id, base_url, before_id, limit)]
+
+async def get_user_qr_history_json(user_id: str, base_url: Optional[str] = None, before_id: Optional[str] = None,
+                                   limit: int = HISTORY_PAGE_SIZE) -> bytes:
+    """
+    Same page as get_user_qr_history, already serialized to JSON bytes.
+    Pages are cached for QR_HISTORY_CACHE_TTL seconds when Redis is configured;
+    writing a logged entry or deleting one drops the user's cached pages.
     """
-    from bson.objectid import ObjectId
+    if history_cache is None:
+        return orjson.dumps(await get_user_qr_history(user_id, base_url, before_id, limit))
+
+    key = history_cache_key(user_id)
+    page = f"{before_id or ''}:{limit}:{base_url or ''}"
+    try:
+        cached = await history_cache.hget(key, page)
+        if cached is not None:
+            return cached
+    except RedisError:
+        pass
+
+    body = orjson.dumps(await get_user_qr_history(user_id, base_url, before_id, limit))
     try:
-        item = await db.db.qr_history.find_one({
-            "_id": ObjectId(history_id),
-            "user_id": user_id
-        })
-        if item:
-            item["_id"] = str(item["_id"])
-        return item
-    except Exception:
+        async with history_cache.pipeline(transaction=False) as pipe:
+            pipe.hset(key, page, body)
+            pipe.expire(key, config.QR_HISTORY_CACHE_TTL)
+            await pipe.execute()
+    except RedisError:
+        pass
+    return body
+
+async def get_qr_history_item(history_id: str, user_id: str, include_qr_code: bool = False):
+    """
+    Retrieve a specific QR history item by ID and user_id.
+    The stored image (qr_png, or qr_code on older entries) is only fetched when include_qr_code is set.
+    """
+    if not ObjectId.is_valid(history_id):
         return None
+    projection = None if include_qr_code else {"qr_png": 0, "qr_code": 0}
+    item = await db.db.qr_history.find_one({
+        "_id": ObjectId(history_id),
+        "user_id": user_id
+    }, projection)
+    if item and include_qr_code:
+        image = await db.db.qr_images.find_one({"_id": item["_id"]})
+        if image:
+            item["qr_png"] = image["qr_png"]
+    if item:
+        item["_id"] = str(item["_id"])
+    return item
+
+async def get_qr_history_items(history_ids: List[str], user_id: str):
+    """
+    Retrieve several of a user's QR history items in one query.
+    Invalid ids are skipped; the stored images are not fetched.
+    """
+    object_ids = [ObjectId(i) for i in history_ids if ObjectId.is_valid(i)]
+    if not object_ids:
+        return []
+    cursor = db.db.qr_history.find({
+        "_id": {"$in": object_ids},
+        "user_id": user_id
+    }, {"qr_png": 0, "qr_code": 0})
+    items = await cursor.to_list(length=len(object_ids))
+    for item in items:
+        item["_id"] = str(item["_id"])
+    return items
 
 async def get_qr_history_item_public(history_id: str):
     """
     Retrieve a specific QR history item by ID ONLY (for public image viewing).
+    Only the image fields are fetched.
     """
-    from bson.objectid import ObjectId
-    try:
-        item = await db.db.qr_history.find_one({
-            "_id": ObjectId(history_id)
-        })
-        if item:
-            item["_id"] = str(item["_id"])
-        return item
-    except Exception:
+    if not ObjectId.is_valid(history_id):
         return None
+    image = await db.db.qr_images.find_one({"_id": ObjectId(history_id)})
+    if image:
+        image["_id"] = history_id
+        return image
+    # Entries logged before the split keep the image in the history document
+    item = await db.db.qr_history.find_one({
+        "_id": ObjectId(history_id)
+    }, {"qr_png": 1, "qr_code": 1})
+    if item:
+        item["_id"] = str(item["_id"])
+    return item
 
 async def delete_qr_history_item(history_id: str, user_id: str) -> bool:
     """
     Delete a specific QR history item.
     """
-    from bson.objectid import ObjectId
-    try:
-        result = await db.db.qr_history.delete_one({
-            "_id": ObjectId(history_id),
-            "user_id": user_id
-        })
-        return result.deleted_count > 0
-    except Exception:
+    if not ObjectId.is_valid(history_id):
+        return False
+    result = await db.db.qr_history.delete_one({
+        "_id": ObjectId(history_id),
+        "user_id": user_id
+    })
+    if result.deleted_count == 0:
         return False
+    await db.db.qr_images.delete_one({"_id": ObjectId(history_id)})
+    await invalidate_user_qr_history(user_id)
+    return True
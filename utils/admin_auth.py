@@ -0,0 +1,21 @@
+"""
+Admin credential check shared by the Flask and FastAPI services.
+"""
+
+import hashlib
+import hmac
+
+ADMIN_USERNAME = "admin@123"
+# Only digests are kept so credentials can be compared in constant time
+ADMIN_USERNAME_DIGEST = hashlib.sha256(ADMIN_USERNAME.encode("utf-8")).digest()
+ADMIN_PASSWORD_DIGEST = hashlib.sha256(b"1234").digest()
+
+
+def check_admin_credentials(username, password) -> bool:
+    """Compare submitted admin credentials against the stored digests in constant time."""
+    username_digest = hashlib.sha256((username or "").encode("utf-8")).digest()
+    password_digest = hashlib.sha256((password or "").encode("utf-8")).digest()
+    # Evaluate both comparisons so timing does not reveal which one failed
+    username_ok = hmac.compare_digest(username_digest, ADMIN_USERNAME_DIGEST)
+    password_ok = hmac.compare_digest(password_digest, ADMIN_PASSWORD_DIGEST)
+    return username_ok and password_ok
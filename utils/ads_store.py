@@ -0,0 +1,42 @@
+"""
+Reading the Flask service's on-disk ads store: a JSON snapshot plus an
+append-only NDJSON log of mutations since the last compaction.
+"""
+
+import os
+from typing import Dict, Tuple
+
+import orjson
+
+
+def read_ads_files(data_file: str, log_file: str) -> Tuple[bytes, bytes]:
+    """Return the raw snapshot and log contents; a missing file reads as empty."""
+    contents = []
+    for path in (data_file, log_file):
+        if os.path.exists(path):
+            with open(path, "rb") as fh:
+                contents.append(fh.read())
+        else:
+            contents.append(b"")
+    return contents[0], contents[1]
+
+
+def replay_ads(snapshot: bytes, log: bytes) -> Dict[int, dict]:
+    """Build ads keyed by id from a snapshot with the mutation log replayed over it."""
+    ads = {}
+    if snapshot:
+        try:
+            ads = {ad["id"]: ad for ad in orjson.loads(snapshot)}
+        except Exception:
+            ads = {}
+
+    for line in log.splitlines():
+        try:
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            continue  # Torn write from a crash mid-append
+        if record.get("op") == "put":
+            ads[record["ad"]["id"]] = record["ad"]
+        elif record.get("op") == "del":
+            ads.pop(record["id"], None)
+    return ads
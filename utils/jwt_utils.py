@@ -1,33 +1,63 @@
+import threading
+import time
 import jwt
-from datetime import datetime, timedelta
+from cachetools import TTLCache
+from datetime import timedelta
 from typing import Optional, Dict
 from config import config
 
 SECRET_KEY = config.SECRET_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  
+ACCESS_TOKEN_EXPIRE_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+# Verified payloads keyed by raw token, so repeat requests skip the HMAC check
+_decoded_tokens = TTLCache(maxsize=4096, ttl=60)
+_decoded_tokens_lock = threading.Lock()
+
+def extract_bearer_token(value: str) -> Optional[str]:
+    """
+    Strip an optional "Bearer " prefix from an Authorization value.
+    Returns None when the prefix is present but no token follows it.
+    """
+    if value[:7].lower() == "bearer ":
+        return value[7:].strip() or None
+    return value
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT access token.
     """
-    to_encode = data.copy()
+    # exp as integer seconds, so PyJWT doesn't have to convert a datetime
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = int(time.time() + expires_delta.total_seconds())
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = int(time.time()) + ACCESS_TOKEN_EXPIRE_SECONDS
     
-    to_encode.update({"exp": expire})
+    to_encode = {**data, "exp": expire}
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def decode_access_token(token: str) -> Optional[Dict]:
     """
     Decode and verify a JWT access token.
+    Verified tokens are cached for a short time; exp is still checked on every hit.
     """
+    with _decoded_tokens_lock:
+        cached = _decoded_tokens.get(token)
+    if cached is not None:
+        return cached if cached["exp"] >= time.time() else None
+
+    payload = _decode_access_token(token)
+    if payload is not None:
+        with _decoded_tokens_lock:
+            _decoded_tokens[token] = payload
+    return payload
+
+def _decode_access_token(token: str) -> Optional[Dict]:
     try:
         decoded_token = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return decoded_token if decoded_token["exp"] >= datetime.utcnow().timestamp() else None
+        return decoded_token if decoded_token["exp"] >= time.time() else None
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
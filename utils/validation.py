@@ -0,0 +1,119 @@
+"""
+Shared request validation helpers for the Flask and FastAPI services.
+"""
+
+import os
+import re
+import secrets
+from functools import lru_cache
+
+# Prefer RE2's linear-time DFA matcher when the optional google-re2 binding is
+# installed; the pattern below uses only syntax both engines understand.
+try:
+    import re2 as _url_regex
+except ImportError:
+    _url_regex = re
+
+ALLOWED_IMAGE_EXTENSIONS = frozenset({"png", "jpg", "jpeg", "gif", "webp"})
+VALID_PLACEMENTS = frozenset({
+    "top-wide",
+    "vertical-right",
+    "left-1",
+    "left-2",
+    "bottom-wide-1",
+    "bottom-wide-2",
+    "mobile-bottom-1",
+    "mobile-bottom-2",
+})
+
+URL_SCHEMES = ("http://", "https://")
+MIN_URL_LENGTH = len("http://a.bc")
+MAX_URL_LENGTH = 2048
+
+# Lowercase-only pattern: inputs are lowercased before matching, which keeps
+# the automaton smaller than case-insensitive matching would.
+URL_REGEX = (
+    r"^https?://"
+    r"(?:(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,6}\.?|"
+    r"localhost|"
+    r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})"
+    r"(?::\d+)?"
+    r"(?:/?|[/?]\S+)$"
+)
+
+# Compiled once at import so validate_url is a single match call per request
+URL_PATTERN = _url_regex.compile(URL_REGEX)
+# Multiline variant that validates a newline-joined batch in one scan
+URL_BATCH_PATTERN = _url_regex.compile(r"(?m)" + URL_REGEX)
+
+
+def _passes_url_prechecks(url) -> bool:
+    """Length and scheme bounds checked before any URL reaches the regex engine."""
+    if not url or not isinstance(url, str) or not MIN_URL_LENGTH <= len(url) <= MAX_URL_LENGTH:
+        return False
+    # Cheap scheme check so malformed input never reaches the regex engine
+    return url[:8].lower().startswith(URL_SCHEMES)
+
+
+def validate_url(url: str) -> bool:
+    """
+    Validate URL format.
+    """
+    if not _passes_url_prechecks(url):
+        return False
+    return _match_url(url)
+
+
+@lru_cache(maxsize=2048)
+def _match_url(url: str) -> bool:
+    # Clients re-validate the same handful of URLs, so remember the verdicts
+    return URL_PATTERN.fullmatch(url.lower()) is not None
+
+
+def validate_urls(urls) -> set:
+    """
+    Validate many URLs with a single regex scan.
+
+    Returns the set of indices into ``urls`` whose entries are valid.
+    """
+    line_starts = {}
+    lines = []
+    offset = 0
+    for index, url in enumerate(urls):
+        # Same bounds as validate_url; line breaks are never valid in a URL and would split the batch
+        if _passes_url_prechecks(url) and "\n" not in url and "\r" not in url:
+            # Lowercase per line: offsets must follow the lowered text's length
+            line = url.lower()
+            line_starts[offset] = index
+            lines.append(line)
+            offset += len(line) + 1
+
+    return {
+        line_starts[match.start()]
+        for match in URL_BATCH_PATTERN.finditer("\n".join(lines))
+        if match.start() in line_starts
+    }
+
+
+def allowed_file(filename: str) -> bool:
+    return os.path.splitext(filename)[1][1:].lower() in ALLOWED_IMAGE_EXTENSIONS
+
+
+def upload_filename(filename: str) -> str:
+    """Random storage name for an upload; only the (already validated) extension is kept."""
+    return f"{secrets.token_urlsafe(16)}{os.path.splitext(filename)[1].lower()}"
+
+
+IMAGE_SIGNATURE_SIZE = 12
+
+
+def is_image_data(head: bytes) -> bool:
+    """
+    Check the leading bytes of an upload against PNG/JPEG/GIF/WebP signatures.
+    """
+    return (
+        head.startswith(b"\x89PNG\r\n\x1a\n")
+        or head.startswith(b"\xff\xd8\xff")
+        or head.startswith((b"GIF87a", b"GIF89a"))
+        or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+    )
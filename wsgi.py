@@ -0,0 +1,15 @@
+"""
+WSGI Entrypoint
+Serves the Flask API service under gunicorn as a single threaded worker:
+
+    gunicorn -k gthread -w 1 --threads 32 -b 0.0.0.0:5000 wsgi:app
+
+Keep it to one process: ads (ads_by_id) and the next ad id live in memory, so
+separate workers would hand out the same ids and disagree about the ads.
+Threads are real OS threads rather than gevent: Motor runs on its own event loop
+thread (see api_service.run_sync), which a monkey-patched greenlet cannot host.
+"""
+
+from api_service import app
+
+__all__ = ["app"]